@@ -0,0 +1,111 @@
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from export import EXTENSIONS, open_export
+from generator import generate
+from logger import Logger
+from parser import TRACE_SUFFIXES, trace_stem
+from profiling import Profile
+
+
+SUMMARY_FIELDS = ['trace', 'output', 'status', 'ticks', 'commands', 'flushes', 'seconds', 'error']
+
+
+def collect_traces(patterns: Iterable[str]) -> List[Path]:
+    # a directory stands for all traces in it, anything else is a glob pattern
+    traces = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            traces.update(path for path in Path(pattern).iterdir() if path.name.lower().endswith(TRACE_SUFFIXES))
+        else:
+            traces.update(Path(path) for path in glob.glob(pattern)
+                          if os.path.isfile(path) and path.lower().endswith(TRACE_SUFFIXES))
+    return sorted(traces)
+
+
+def process_trace(input_path: Path, output_path: Path, output_format: str, columnar: bool = False) -> Dict:
+    # runs in a worker; a failed trace is reported in the summary and does not stop the others
+    summary = {'trace': str(input_path), 'output': str(output_path), 'status': 'ok',
+               'ticks': 0, 'commands': 0, 'flushes': 0, 'seconds': 0.0, 'error': ''}
+    profile = Profile()
+    started = time.perf_counter()
+    try:
+        export = open_export(output_format, output_path)
+        try:
+            ticks, _ = generate(input_path, columnar=columnar, on_retire=export.write, profile=profile)
+        except BaseException:
+            export.discard()
+            raise
+        export.close(ticks)
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    for name in ('ticks', 'commands', 'flushes'):
+        summary[name] = profile[name]
+    return summary
+
+
+def write_summary(summaries: List[Dict], summary_path: Path) -> None:
+    with open(summary_path, 'w', newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate pipeline visualizations for many traces')
+    parser.add_argument('inputs', nargs='+', help='.lst (.lst.gz, .lst.xz, .lst.zst) files, directories with them or glob patterns')
+    parser.add_argument('--output-dir', help='Directory for the outputs (default: next to every trace)')
+    parser.add_argument('--format', choices=EXTENSIONS, default='csv', help='Output format, as in generator.py')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Traces processed at the same time')
+    parser.add_argument('--numpy', action='store_true', help='Decode signals into NumPy columns (needs numpy)')
+    parser.add_argument('--summary', help='Write the per-trace summary to this CSV file')
+
+    args = parser.parse_args()
+
+    traces = collect_traces(args.inputs)
+    if not traces:
+        Logger.critical(f"No .lst files found in: {' '.join(args.inputs)}")
+        raise SystemExit(1)
+
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    Logger.info(f"Processing {len(traces)} traces in {args.jobs} processes")
+    started = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max(args.jobs, 1)) as pool:
+        futures = []
+        for trace in traces:
+            output_path = (output_dir or trace.parent) / f"{trace_stem(trace)}{EXTENSIONS[args.format]}"
+            futures.append(pool.submit(process_trace, trace, output_path, args.format, args.numpy))
+
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            if summary['status'] == 'ok':
+                Logger.info(f"{summary['trace']}: {summary['ticks']} ticks, {summary['commands']} commands, "
+                            f"{summary['flushes']} flushes, {summary['seconds']}s -> {summary['output']}")
+            else:
+                Logger.error(f"{summary['trace']}: {summary['error']}")
+
+    summaries.sort(key=lambda summary: summary['trace'])
+    failed = sum(summary['status'] != 'ok' for summary in summaries)
+    Logger.info(f"Done in {time.perf_counter() - started:.2f}s: {len(summaries) - failed} ok, {failed} failed")
+    if args.summary:
+        write_summary(summaries, Path(args.summary))
+        Logger.info(f"Summary written to {args.summary}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from columnar import np
+from export import EXTENSIONS
+from logger import Logger
+from synth import TraceSynthesizer
+
+
+SIZES = (10_000, 100_000, 1_000_000)
+GENERATOR = Path(__file__).with_name("generator.py")
+
+
+def modes() -> Dict[str, List[str]]:
+    # generator.py options of every measured mode, all of them must give the same output
+    modes = {"serial": []}
+    if np is not None:
+        modes["numpy"] = ["--numpy"]
+    modes["jobs"] = ["--jobs", str(max(os.cpu_count() or 1, 2))]
+    return modes
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def synthesize(work_dir: Path, cycles: int, seed: int) -> Path:
+    # traces are kept between runs, a new one is only written for a new size or seed
+    trace = work_dir / f"synth-{cycles}-{seed}.lst"
+    if not trace.exists():
+        started = time.perf_counter()
+        partial = trace.with_suffix(".part")
+        TraceSynthesizer(seed=seed).write(partial, cycles)
+        partial.replace(trace)
+        Logger.info(f"Synthesized {trace} ({trace.stat().st_size >> 20} MiB) in {time.perf_counter() - started:.1f}s")
+    return trace
+
+
+def run_mode(trace: Path, mode: str, options: List[str], output_format: str) -> Optional[Dict]:
+    # every run is a fresh process, the to_int cache of one mode does not carry over to the next
+    output = trace.with_name(f"{trace.stem}.{mode}{EXTENSIONS[output_format]}")
+    stats = trace.with_name(f"{trace.stem}.{mode}.stats.json")
+    stats.unlink(missing_ok=True)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, str(GENERATOR), str(trace), str(output), "--format", output_format,
+                    "--stats-json", str(stats), "--log-level", "WARNING", "--no-cache"] + options, check=True)
+    seconds = time.perf_counter() - started
+    if not stats.exists():
+        # generator.py logs its errors and does not write statistics
+        Logger.error(f"{trace.name} [{mode}] failed")
+        return None
+
+    with open(stats, encoding="utf-8") as f:
+        report = json.load(f)
+    return {
+        "mode": mode,
+        "seconds": round(seconds, 3),
+        "stages": {stage: values["seconds"] for stage, values in report["stages"].items()},
+        "cycles_per_second": round(report["counters"]["ticks"] / seconds) if seconds else None,
+        "peak_memory_bytes": report["peak_memory_bytes"],
+        "sha256": file_digest(output),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time generator.py on synthetic traces of growing size')
+    parser.add_argument('--cycles', type=int, nargs='+', default=SIZES,
+                        help='Trace sizes in cycles (10000000 needs about 20 GiB of disk)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic traces')
+    parser.add_argument('--format', choices=EXTENSIONS, default='sparse',
+                        help='Output format (dense formats grow as cycles x commands)')
+    parser.add_argument('--work-dir', default=Path(tempfile.gettempdir()) / "pipeline-benchmark",
+                        help='Where traces and outputs are kept')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--compare', help='Results of an earlier run: outputs must not have changed')
+
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = {(result["cycles"], result["seed"], result["format"]): result["sha256"] for result in json.load(f)}
+
+    results = []
+    failed = False
+    for cycles in args.cycles:
+        trace = synthesize(work_dir, cycles, args.seed)
+        for mode, options in modes().items():
+            result = run_mode(trace, mode, options, args.format)
+            if result is None:
+                failed = True
+                continue
+            result.update(cycles=cycles, seed=args.seed, format=args.format)
+            results.append(result)
+
+            stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stages"].items())
+            memory = result["peak_memory_bytes"]
+            Logger.info(f"{cycles} cycles [{mode}]: {result['seconds']:.2f}s, {result['cycles_per_second']} cycles/s "
+                        f"({stages}), peak memory {memory >> 20 if memory else '?'} MiB")
+
+            # the output of an earlier run, or else of the first mode
+            reference = previous.get((cycles, args.seed, args.format)) or \
+                next(other["sha256"] for other in results if other["cycles"] == cycles)
+            if result["sha256"] != reference:
+                Logger.error(f"{cycles} cycles [{mode}]: output differs ({result['sha256'][:12]} != {reference[:12]})")
+                failed = True
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        Logger.info(f"Results saved to {args.output}")
+    if failed:
+        raise SystemExit(1)
+    Logger.info("All outputs are identical")
+
+
+if __name__ == '__main__':
+    main()
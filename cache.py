@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from export import command_from_record, command_record
+from logger import Logger
+from processor import CommandProcessing, Window
+
+
+# bump when the cache file layout changes
+CACHE_FORMAT = 1
+CACHE_SUFFIX = ".commands.gz"
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "trace-riscv-excel-gen"
+DEFAULT_CACHE_LIMIT = 1 << 30
+
+# the modules the retired commands depend on; any change to them invalidates the cache
+SOURCES = ("parser.py", "convert.py", "columnar.py", "parallel.py", "trace_index.py", "processor.py", "generator.py",
+           "export.py")
+
+
+def tool_version() -> str:
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    for source in SOURCES:
+        digest.update(Path(__file__).with_name(source).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+class CommandCache:
+    # retired commands of a run, keyed by the trace (path, size, mtime), the window and the
+    # tool version; a later run with another output format only exports them again.
+    # The least recently used entries are removed once the directory grows over limit bytes
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR, limit: int = DEFAULT_CACHE_LIMIT):
+        self.directory = Path(directory)
+        self.limit = limit
+        self._version = tool_version()
+
+    def path_for(self, input_path: Path, window: Optional[Window], warmup: int) -> Path:
+        stat = Path(input_path).stat()
+        window_key = [window.from_tick, window.to_tick, window.pc_low, window.pc_high, warmup] if window else None
+        key = json.dumps([str(Path(input_path).resolve()), stat.st_size, stat.st_mtime_ns, window_key, self._version])
+        return self.directory / (hashlib.sha256(key.encode()).hexdigest()[:32] + CACHE_SUFFIX)
+
+    def load(self, path: Path) -> Optional[Tuple[int, Iterator[CommandProcessing]]]:
+        try:
+            f = gzip.open(path, "rb")
+        except OSError:
+            return None
+        try:
+            tick_count, count = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+            f.close()
+            return None
+        os.utime(path)  # the mtime is the last use
+        return tick_count, self._read(f, count)
+
+    @staticmethod
+    def _read(f, count: int) -> Iterator[CommandProcessing]:
+        with f:
+            for _ in range(count):
+                yield command_from_record(pickle.load(f))
+
+    def recorder(self, path: Path) -> Optional["CacheRecorder"]:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            return CacheRecorder(self, path)
+        except OSError as e:
+            Logger.warning(f"Cache disabled, cannot write to {self.directory}: {e}")
+            return None
+
+    def evict(self) -> None:
+        entries = []
+        for entry in self.directory.glob("*" + CACHE_SUFFIX):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.limit:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+
+class CacheRecorder:
+    # written next to the entry and renamed once the run is complete,
+    # so a failed or interrupted run leaves no entry behind
+    def __init__(self, cache: CommandCache, path: Path):
+        self.cache = cache
+        self.path = path
+        self.count = 0
+        self._records = tempfile.TemporaryFile(dir=cache.directory)
+
+    def write(self, command: CommandProcessing) -> None:
+        pickle.dump(command_record(command), self._records, pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def close(self, tick_count: int) -> None:
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with self._records, gzip.open(temporary, "wb", compresslevel=1) as f:
+                pickle.dump((tick_count, self.count), f, pickle.HIGHEST_PROTOCOL)
+                self._records.seek(0)
+                for block in iter(lambda: self._records.read(1 << 20), b""):
+                    f.write(block)
+            temporary.replace(self.path)
+        except OSError as e:
+            temporary.unlink(missing_ok=True)
+            Logger.warning(f"Cannot save cache {self.path}: {e}")
+            return
+        self.cache.evict()
+
+    def discard(self) -> None:
+        self._records.close()
@@ -0,0 +1,215 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from convert import to_int, tick_from_cyc_cnt
+from logger import Logger
+from parser import ColumnLayout, decode_cell, decode_fields, open_trace
+from trace_index import CHECKPOINT_CYCLES, TICK_SIGNAL
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# one number per cycle, decoded once into typed arrays
+SCALAR_SIGNALS = (
+    "/tb/cyc_cnt",
+    "/tb/uut/cpu/fetch_block/pc",
+    "/tb/uut/cpu/fetch_block/pc_id_assigned",
+    "/tb/uut/cpu/fetch_block/fetch_complete",
+    "/tb/uut/cpu/fetch_block/fetch_instruction",
+    "/tb/uut/cpu/id_block/pc_id",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[0]/new_request",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[1]/new_request",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[2]/new_request",
+    "/tb/uut/cpu/gc_unit_block/gc_fetch_flush",
+)
+# structs generate() only reads numbers from, kept as the tuples of their fields
+FIELD_SIGNALS = (
+    "/tb/uut/cpu/id_block/pc_table",
+    "/tb/uut/cpu/id_block/decode",
+    "/tb/uut/cpu/decode_and_issue_block/issue",
+)
+
+NEWLINE, SPACE, QUOTE, HEX_MARK = ord("\n"), ord(" "), ord("'"), ord("h")
+# digits of a literal longer than this do not fit in int64 and are converted one by one
+MAX_DIGITS = 15
+
+
+def _hex_table() -> "np.ndarray":
+    # value of every hex digit byte, 255 for anything else (x, z, spaces)
+    table = np.full(256, 255, np.uint8)
+    for digit in "0123456789abcdef":
+        table[ord(digit)] = table[ord(digit.upper())] = int(digit, 16)
+    return table
+
+
+def _line_bounds(data: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    # start and end (at the newline) of every line of a block of whole lines
+    ends = np.flatnonzero(data == NEWLINE)
+    if not len(ends) or ends[-1] != len(data) - 1:
+        ends = np.r_[ends, len(data)]
+    return np.r_[0, ends[:-1] + 1], ends
+
+
+def _cells(data: "np.ndarray", starts: "np.ndarray", ends: "np.ndarray", columns: List[slice]) -> List["np.ndarray"]:
+    # every column of every line as a (lines, width) byte matrix, short lines padded with spaces;
+    # the columns are cut in one gather, rows far apart in the file are touched once.
+    # A block is far below 2 GiB, its positions fit in int32
+    offsets = np.concatenate([np.arange(column.start, column.stop, dtype=np.int32) for column in columns])
+    positions = starts.astype(np.int32)[:, None] + offsets
+    cells = np.where(positions < ends[:, None], data[np.minimum(positions, len(data) - 1)], SPACE).astype(np.uint8)
+    bounds = np.cumsum([0] + [column.stop - column.start for column in columns])
+    return [cells[:, start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+def _parse_hex(cells: "np.ndarray", hex_table: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    # vectorized to_int of "N'hDIGITS" cells: values, a validity mask (no x/z) and a mask of the
+    # cells that were parsed here; other literals are left for to_int.
+    # Values are right-aligned, the blank left part of a wide column is cut off first
+    filled = np.flatnonzero((cells != SPACE).any(axis=0))
+    if len(filled):
+        cells = cells[:, min(filled[0], cells.shape[1] - 2):]
+    width = cells.shape[1]
+    columns = np.arange(width)
+    marks = (cells[:, :-1] == QUOTE) & (cells[:, 1:] == HEX_MARK)
+    parsed = marks.any(axis=1)
+    first_digit = np.argmax(marks, axis=1) + 2
+    last_digit = width - 1 - np.argmax((cells != SPACE)[:, ::-1], axis=1)
+    digits = (columns >= first_digit[:, None]) & (columns <= last_digit[:, None])
+
+    nibbles = hex_table[cells]
+    count = digits.sum(axis=1)
+    parsed &= count <= MAX_DIGITS
+    valid = parsed & (count > 0) & ~(digits & (nibbles == 255)).any(axis=1)
+    shifts = np.maximum(last_digit[:, None] - columns, 0) * 4
+    values = (np.where(digits & valid[:, None], nibbles, 0).astype(np.int64) << shifts).sum(axis=1)
+    return values, valid, parsed
+
+
+class RowSelector:
+    # same choice as parser.average_signal_data_by_tick, a block at a time: unknown (-1) and
+    # backward cyc_cnt rows are dropped, then the middle row of every cycle is kept.
+    # The last cycle of a block may go on in the next one, its lines are read again with it
+    def __init__(self, checkpoints: List[Tuple[int, int]]):
+        # the first row of every CHECKPOINT_CYCLES-th cycle goes to checkpoints, as IndexBuilder does
+        self.checkpoints = checkpoints
+        self.dropped = 0
+        self._cycles = 0
+        self._max_tick = -1
+
+    def select(self, ticks: "np.ndarray", starts: "np.ndarray", position: int,
+               last: bool) -> Tuple["np.ndarray", "np.ndarray", int]:
+        # ticks and middle lines of the cycles finished in the block, and the line
+        # the unfinished one starts at (len(ticks) when there is none)
+        known = ticks >= 0
+        running_max = np.maximum(np.maximum.accumulate(np.where(known, ticks, -1)), self._max_tick)
+        kept = np.flatnonzero(known & (ticks == running_max))
+        kept_ticks = ticks[kept]
+        first = np.flatnonzero(np.r_[True, kept_ticks[1:] != kept_ticks[:-1]]) if len(kept) else kept
+
+        carry, finished, kept_before = len(ticks), len(first), len(kept)
+        if not last and len(first):
+            carry, finished, kept_before = kept[first[-1]], len(first) - 1, first[-1]
+        self.dropped += int(np.count_nonzero(known[:carry])) - int(kept_before)
+        if not finished:
+            return kept_ticks[:0], kept[:0], carry
+
+        bounds = np.r_[first, len(kept)][:finished + 1]
+        cycle_ticks = kept_ticks[bounds[:-1]]
+        middle = kept[bounds[:-1] + np.diff(bounds) // 2]
+        numbers = self._cycles + np.arange(finished)
+        marked = kept[bounds[:-1]][numbers % CHECKPOINT_CYCLES == 0]
+        self.checkpoints.extend(zip(ticks[marked].tolist(), (starts[marked] + position).tolist()))
+        self._cycles += finished
+        self._max_tick = int(cycle_ticks[-1])
+        return cycle_ticks, middle, carry
+
+
+def _scan_ticks(data: "np.ndarray", starts: "np.ndarray", ends: "np.ndarray", tick_column: slice,
+                hex_table: "np.ndarray") -> "np.ndarray":
+    # cyc_cnt of every line, -1 where unknown
+    cells, = _cells(data, starts, ends, [tick_column])
+    ticks, valid, parsed = _parse_hex(cells, hex_table)
+    ticks = np.where(valid, ticks, -1)
+    for row in np.flatnonzero(~parsed).tolist():
+        tick = tick_from_cyc_cnt(cells[row].tobytes().decode())
+        ticks[row] = -1 if tick is None else tick
+    return ticks
+
+
+def _scalars(cells: "np.ndarray", hex_table: "np.ndarray") -> List[Optional[int]]:
+    values, valid, parsed = _parse_hex(cells, hex_table)
+    values = values.tolist()
+    for row in np.flatnonzero(~valid).tolist():
+        values[row] = to_int(cells[row].tobytes().strip().decode()) if not parsed[row] else None
+    return values
+
+
+def _decode(layout: ColumnLayout, data: "np.ndarray", starts: "np.ndarray", ends: "np.ndarray",
+            hex_table: "np.ndarray") -> List[list]:
+    # the selected signals of the chosen lines, column by column
+    columns = []
+    for name, cells in zip(layout.names, _cells(data, starts, ends, layout.slices)):
+        if name in SCALAR_SIGNALS:
+            columns.append(_scalars(cells, hex_table))
+        elif name in FIELD_SIGNALS:
+            columns.append([decode_fields(cell.tobytes().strip().decode()) for cell in cells])
+        else:
+            columns.append([decode_cell(cell.tobytes()) for cell in cells])
+    return columns
+
+
+def columnar_cycles(filename: Path, signals: Iterable[str], start_tick: Optional[int] = None,
+                    end_tick: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+    # the same (tick, values) cycles as parallel.parse_parallel: scalars as ints, the structs
+    # in FIELD_SIGNALS as tuples of ints. Every block of lines is decoded with array operations
+    # and its cycles are yielded before the next one is read; reading stops after end_tick
+    if np is None:
+        raise Exception("NumPy is required for the columnar backend, install it with `pip install numpy`")
+    hex_table = _hex_table()
+
+    with open_trace(filename, start_tick) as source:
+        layout = source.layout(signals)
+        tick_column = source.layout([TICK_SIGNAL]).slices[0]
+        selector = RowSelector(source.index.checkpoints if source.builds_index else [])
+        carry, carry_position = np.empty(0, np.uint8), 0
+        complete = ended = False
+
+        def cycles(data: "np.ndarray", position: int, last: bool) -> Iterator[Tuple[int, Dict]]:
+            nonlocal carry, carry_position, ended
+            starts, ends = _line_bounds(data)
+            ticks = _scan_ticks(data, starts, ends, tick_column, hex_table)
+            cycle_ticks, rows, carry_line = selector.select(ticks, starts, position, last)
+            if end_tick is not None and len(cycle_ticks) and cycle_ticks[-1] > end_tick:
+                # only the cycles up to end_tick are decoded, no block is read after this one
+                count = int(np.searchsorted(cycle_ticks, end_tick, side="right"))
+                cycle_ticks, rows, ended = cycle_ticks[:count], rows[:count], True
+            # the lines of the unfinished cycle, copied out of a block that is released next
+            carry = data[starts[carry_line]:].copy() if carry_line < len(starts) else data[:0]
+            carry_position = position + int(starts[carry_line]) if carry_line < len(starts) else 0
+            if not len(rows):
+                return
+            columns = _decode(layout, data, starts[rows], ends[rows], hex_table)
+            for tick, values in zip(cycle_ticks.tolist(), zip(*columns)):
+                yield tick, dict(zip(layout.names, values))
+
+        try:
+            for position, buffer, start, end in source.blocks():
+                block = np.frombuffer(buffer, np.uint8)[start:end]
+                if len(carry):
+                    yield from cycles(np.concatenate([carry, block]), carry_position, False)
+                else:
+                    yield from cycles(block, position, False)
+                if ended:
+                    return
+            if len(carry):
+                yield from cycles(carry, carry_position, True)
+            complete = True
+        finally:
+            if selector.dropped:
+                Logger.warning(f"cyc_cnt went backwards, {selector.dropped} rows skipped")
+            if source.builds_index:
+                # even a partial index lets the next windowed run seek
+                source.save_index(complete)
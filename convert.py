@@ -1,38 +1,76 @@
+from functools import lru_cache
+from typing import Iterable, List
+
+
+# signal values repeat a lot (PCs in loops, 0/1 flags, unchanged tables),
+# so conversions are memoized in a bounded LRU cache
+CACHE_SIZE = 1 << 16
+
 
 def to_int(value: str | int, base: int = 16) -> int | None:
     if value is None:
         return None
     if isinstance(value, int):
         return value
-    
-    value_str = str(value)
-    
+
+    return _str_to_int(value if isinstance(value, str) else str(value), base)
+
+
+def to_ints(values: Iterable, base: int = 16) -> List[int | None]:
+    return [to_int(value, base) for value in values]
+
+
+def tick_from_cyc_cnt(cyc_cnt: str) -> int | None:
+    try:
+        if "'h" in cyc_cnt:
+            hex_value = cyc_cnt.split("'h")[1]
+            if 'x' not in hex_value and hex_value:
+                return int(hex_value, 16)
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def cache_stats() -> dict:
+    info = _str_to_int.cache_info()
+    calls = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "hit_rate": info.hits / calls if calls else 0.0,
+    }
+
+
+def clear_cache() -> None:
+    _str_to_int.cache_clear()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _str_to_int(value_str: str, base: int) -> int | None:
     # hex "32'hxxxxxxxx"
     if "'h" in value_str:
-        try:
-            hex_value = value_str.split("'h")[1]
-            if 'x' in hex_value.lower() or not hex_value:
-                return None
-            return int(hex_value, 16)
-        except (ValueError, IndexError):
-            return None
-    
+        return _digits_to_int(value_str.split("'h")[1], 16)
+
     # bin
     if "'b" in value_str:
-        try:
-            bin_value = value_str.split("'b")[1]
-            if 'x' in bin_value.lower() or not bin_value:
-                return None
-            return int(bin_value, 2)
-        except (ValueError, IndexError):
-            return None
-    
+        return _digits_to_int(value_str.split("'b")[1], 2)
+
     # skip unknown strings
     if any(x in value_str.lower() for x in ['x', 'z']) or value_str in ['***']:
         return None
-    
+
     # finally try to convert
     try:
         return int(value_str, base) if value_str.isnumeric() else int(value_str)
     except (ValueError, TypeError):
         return None
+
+
+def _digits_to_int(digits: str, base: int) -> int | None:
+    if not digits or 'x' in digits or 'X' in digits:
+        return None
+    try:
+        return int(digits, base)
+    except ValueError:
+        return None
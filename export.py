@@ -1,47 +1,184 @@
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 import csv
+import pickle
+import tempfile
 import xlsxwriter
+from processor import STAGE_NAMES, CommandProcessing
 
 
-def export_to_csv(completed_commands: list, tick_count: int, output_path: Path) -> None:
+def _tick_line(command, tick_count: int, first_tick: int = 1) -> list:
+    tick_line = [""] * tick_count
+    first = max(command.start_tick, first_tick)
+    last = min(command.last_tick, first_tick + tick_count - 1)
+    if first <= last:
+        tick_line[first - first_tick:last - first_tick + 1] = [
+            STAGE_NAMES[code] for code in command.stage_codes(first, last)
+        ]
+    return tick_line
+
+
+def _command_columns(command) -> list:
+    address_hex = hex(command.address)[2:] if command.address else "unknown"
+    instruction_hex = hex(command.instruction)[2:].rjust(8, "0") if command.instruction else "unknown"
+    return [address_hex, instruction_hex]
+
+
+def run_length(runs) -> str:
+    # "F ID 3W D AL": a stage per run, prefixed by its length when it lasts more than one tick
+    return " ".join(f"{length}{STAGE_NAMES[stage]}" if length > 1 else STAGE_NAMES[stage] for _, length, stage in runs)
+
+
+def export_to_csv(completed_commands: Iterable, tick_count: int, output_path: Path, first_tick: int = 1) -> None:
     with open(output_path, 'w', newline="") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['Адрес', 'Код', 'id'] + list(range(1, tick_count + 1)))
+        writer.writerow(['Адрес', 'Код', 'id'] + list(range(first_tick, first_tick + tick_count)))
         
         for command in completed_commands:
-            tick_line = [""] * tick_count
-            for tick, state in command.history.items():
-                if 1 <= tick <= tick_count:
-                    tick_line[tick - 1] = state
-            
-            address_hex = hex(command.address)[2:] if command.address else "unknown"
-            instruction_hex = hex(command.instruction)[2:].rjust(8, "0") if command.instruction else "unknown"
-            
-            writer.writerow([address_hex, instruction_hex, command.id] + tick_line)
-
-
-def export_to_xlsx(completed_commands: list, tick_count: int, output_path: Path) -> None:    
-    workbook = xlsxwriter.Workbook(output_path)
-    worksheet = workbook.add_worksheet()
-
-    headers = ['Адрес', 'Код', 'id'] + list(range(1, tick_count + 1))
-    for col_num, header in enumerate(headers):
-        worksheet.write(0, col_num, str(header))
-    
+            tick_line = _tick_line(command, tick_count, first_tick)
+            writer.writerow(_command_columns(command) + [command.id] + tick_line)
+
+
+# Excel allows 16384 columns, the first three hold the command
+SHEET_TICKS = 16384 - 3
+
+
+def export_to_xlsx(completed_commands: Iterable, tick_count: int, output_path: Path, first_tick: int = 1) -> None:
+    # rows are streamed to disk (constant_memory), a command writes only the ticks it was in the pipeline;
+    # long traces continue on the next sheet with the same rows
+    workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True})
+    # one format shared by all stage cells
+    stage_format = workbook.add_format({'align': 'center'})
+    sheet_firsts = list(range(first_tick, first_tick + tick_count, SHEET_TICKS)) or [first_tick]
+    last_tick = first_tick + tick_count - 1
+
+    worksheets = []
+    for sheet_first in sheet_firsts:
+        sheet_last = min(sheet_first + SHEET_TICKS - 1, last_tick)
+        worksheet = workbook.add_worksheet(f"{sheet_first}-{sheet_last}" if len(sheet_firsts) > 1 else None)
+        worksheet.write_row(0, 0, ['Адрес', 'Код', 'id'] + [str(tick) for tick in range(sheet_first, sheet_last + 1)])
+        worksheet.set_column(0, 1, 10)
+        worksheet.set_column(2, 2 + sheet_last - sheet_first + 1, 2.5)
+        worksheets.append((worksheet, sheet_first, sheet_last))
+
     for row_num, command in enumerate(completed_commands, 1):
-        tick_line = [""] * tick_count
-        for tick, state in command.history.items():
-            if 1 <= tick <= tick_count:
-                tick_line[tick - 1] = state
-        
-        address_hex = hex(command.address)[2:] if command.address else "unknown"
-        instruction_hex = hex(command.instruction)[2:].rjust(8, "0") if command.instruction else "unknown"
-        
-        row_data = [address_hex, instruction_hex, command.id] + tick_line
-        for col_num, value in enumerate(row_data):
-            worksheet.write(row_num, col_num, value)
-    
-    worksheet.set_column(0, 1, 10)
-    worksheet.set_column(2, len(headers) - 1, 2.5)
+        columns = _command_columns(command) + [command.id]
+        for worksheet, sheet_first, sheet_last in worksheets:
+            worksheet.write_row(row_num, 0, columns)
+            for start, length, stage in command.runs:
+                first, last = max(start, sheet_first), min(start + length - 1, sheet_last)
+                if stage and first <= last:
+                    worksheet.write_row(row_num, 3 + first - sheet_first, [STAGE_NAMES[stage]] * (last - first + 1), stage_format)
+
     workbook.close()
 
+
+def command_record(command: CommandProcessing) -> tuple:
+    # what the exporters need of a retired command, compact enough to pickle
+    return command.address, command.instruction, command.id, command.start_tick, command.runs
+
+
+def command_from_record(record: tuple) -> CommandProcessing:
+    address, instruction, id, start_tick, runs = record
+    command = CommandProcessing(None, address, id)
+    command.instruction = instruction
+    command.start_tick = start_tick
+    command.runs = runs
+    return command
+
+
+class SpooledExport:
+    # the dense formats need the final tick count for their header, so retired commands
+    # are kept compactly in a temporary file meanwhile and expanded only in close()
+    def __init__(self, output_path: Path, export: Callable[[Iterator, int, Path, int], None]):
+        self.output_path = output_path
+        self.export = export
+        self.count = 0
+        self._spool = tempfile.TemporaryFile()
+
+    def write(self, command: CommandProcessing) -> None:
+        pickle.dump(command_record(command), self._spool, pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def _read_back(self) -> Iterator[CommandProcessing]:
+        self._spool.seek(0)
+        for _ in range(self.count):
+            yield command_from_record(pickle.load(self._spool))
+
+    def flush(self) -> None:
+        # nothing is in the output before close()
+        pass
+
+    def close(self, tick_count: int, first_tick: int = 1) -> None:
+        try:
+            self.export(self._read_back(), tick_count, self.output_path, first_tick)
+        finally:
+            self._spool.close()
+
+    def discard(self) -> None:
+        # a failed run: nothing was written to the output yet
+        self._spool.close()
+
+
+class SparseCsvExport:
+    # one line per command with its stages run-length encoded, written as commands retire
+    header = ['id', 'Адрес', 'Код', 'Начало', 'Стадии']
+
+    def __init__(self, output_path: Path):
+        self.output_path = output_path
+        self.count = 0
+        self._file = open(output_path, 'w', newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.header)
+
+    def row(self, command: CommandProcessing) -> list:
+        return [command.id] + _command_columns(command) + [command.start_tick, run_length(command.runs)]
+
+    def write(self, command: CommandProcessing) -> None:
+        self._writer.writerow(self.row(command))
+        self.count += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self, tick_count: int, first_tick: int = 1) -> None:
+        self._file.close()
+
+    def discard(self) -> None:
+        # a failed run leaves no partial output behind
+        self._file.close()
+        Path(self.output_path).unlink(missing_ok=True)
+
+
+class WindowCsvExport(SparseCsvExport):
+    # dense stages, but only over the ticks the command was in the pipeline
+    header = ['Адрес', 'Код', 'id', 'Начало']
+
+    def row(self, command: CommandProcessing) -> list:
+        stages = [STAGE_NAMES[code] for code in command.stage_codes(command.start_tick, command.last_tick)]
+        return _command_columns(command) + [command.id, command.start_tick] + stages
+
+
+FORMATS = {
+    "csv": "CSV",
+    "excel": "Excel",
+    "sparse": "sparse CSV",
+    "window": "windowed CSV",
+}
+
+EXTENSIONS = {
+    "csv": ".csv",
+    "excel": ".xlsx",
+    "sparse": ".sparse.csv",
+    "window": ".window.csv",
+}
+
+
+def open_export(output_format: str, output_path: Path):
+    if output_format == "excel":
+        return SpooledExport(output_path, export_to_xlsx)
+    if output_format == "sparse":
+        return SparseCsvExport(output_path)
+    if output_format == "window":
+        return WindowCsvExport(output_path)
+    return SpooledExport(output_path, export_to_csv)
@@ -0,0 +1,65 @@
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from logger import Logger
+from parser import BLOCK_BYTES, ColumnLayout, Row, iter_rows, read_header
+
+
+POLL_INTERVAL = 0.5
+# the simulation is considered finished after this many seconds without new rows
+IDLE_TIMEOUT = 30.0
+
+
+class Follow:
+    # reads a .lst that Modelsim is still writing: rows are taken from the last consumed offset
+    # up to the last complete line, then the file is polled for more
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, poll_interval: float = POLL_INTERVAL,
+                 on_wait: Optional[Callable[[], None]] = None):
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        # called when all written rows are consumed, before waiting for more
+        self.on_wait = on_wait
+
+    def rows(self, filename: Path, signals: Optional[Iterable[str]] = None) -> Iterator[Row]:
+        layout = None
+        offset = 0
+        last_growth = time.monotonic()
+
+        with open(filename, "rb") as f:
+            while True:
+                if layout is None:
+                    # the header is complete once the first data line is there
+                    f.seek(0)
+                    try:
+                        headers_by_ends, offset = read_header(f)
+                    except Exception:
+                        headers_by_ends = None
+                    if headers_by_ends is not None:
+                        layout = ColumnLayout(headers_by_ends, signals)
+
+                if layout is not None:
+                    f.seek(offset)
+                    block = f.read(BLOCK_BYTES)
+                    end = block.rfind(b"\n") + 1
+                    if end:
+                        yield from iter_rows(layout, block, 0, end)
+                        offset += end
+                        last_growth = time.monotonic()
+                        continue
+                    if os.fstat(f.fileno()).st_size < offset:
+                        Logger.warning(f"{filename} was truncated, stopped following it")
+                        return
+
+                if time.monotonic() - last_growth > self.idle_timeout:
+                    # the writer is done, a last line may have no newline
+                    if layout is not None:
+                        f.seek(offset)
+                        tail = f.read()
+                        yield from iter_rows(layout, tail, 0, len(tail))
+                    return
+                if self.on_wait:
+                    self.on_wait()
+                # Ctrl+C is handled by the reader, which finishes the output
+                time.sleep(self.poll_interval)
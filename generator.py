@@ -1,156 +1,355 @@
 import argparse
 import traceback
+from contextlib import nullcontext
 from pathlib import Path
-from parser import parse
-from convert import to_int
-from export import export_to_xlsx, export_to_csv
-from processor import CommandProcessingManager
+from typing import Callable, Iterator, Tuple
+from parser import parse, average_signal_data_by_tick, TRACE_SUFFIXES, is_compressed, trace_stem
+from convert import to_int, to_ints, cache_stats
+from export import EXTENSIONS, FORMATS, open_export
+from processor import CommandProcessingManager, Window
+from columnar import FIELD_SIGNALS, SCALAR_SIGNALS, columnar_cycles
+from parallel import parse_parallel
 from logger import LogLevel, Logger
+from profiling import Profile, track_memory
+from pipeline_stats import SUMMARY_SUFFIX, TOP_STALLS, PipelineStats
+from follow import IDLE_TIMEOUT, Follow
+from cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_LIMIT, CommandCache
 
 
-def average_signal_data_by_tick(data: dict) -> list:
-    data_index_by_cyc_cnt = {}
-    
-    for index, cyc_cnt in enumerate(data["/tb/cyc_cnt"]):
-        try:
-            if "'h" in cyc_cnt:
-                hex_value = cyc_cnt.split("'h")[1]
-                if 'x' not in hex_value and hex_value:
-                    tick = int(hex_value, 16)
-                    data_index_by_cyc_cnt.setdefault(tick, []).append(index)
-        except (ValueError, IndexError):
-            continue
-    
-    return [
-        (cyc_cnt, index_list[len(index_list) // 2])
-        for cyc_cnt, index_list in sorted(data_index_by_cyc_cnt.items())
-    ]
+# signals read by generate(), everything else in the dump is skipped while parsing
+SIGNALS = (
+    "/tb/cyc_cnt",
+    "/tb/uut/cpu/fetch_block/pc",
+    "/tb/uut/cpu/fetch_block/pc_id_assigned",
+    "/tb/uut/cpu/fetch_block/fetch_complete",
+    "/tb/uut/cpu/fetch_block/fetch_instruction",
+    "/tb/uut/cpu/id_block/pc_id",
+    "/tb/uut/cpu/id_block/pc_table",
+    "/tb/uut/cpu/id_block/decode",
+    "/tb/uut/cpu/id_block/decode_advance",
+    "/tb/uut/cpu/decode_and_issue_block/issue",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[0]/new_request",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[1]/new_request",
+    "/tb/uut/cpu/decode_and_issue_block/unit_issue[2]/new_request",
+    "/tb/uut/cpu/decode_and_issue_block/rs1_conflict",
+    "/tb/uut/cpu/decode_and_issue_block/rs2_conflict",
+    "/tb/uut/cpu/gc_unit_block/gc_fetch_flush",
+)
+
+# cycles simulated before --from-tick to pick up the commands already in flight
+WARMUP_TICKS = 1000
+
+
+def parse_pc_range(text: str) -> Tuple["int | None", "int | None"]:
+    low, _, high = text.partition(":")
+    return (int(low, 16) if low else None), (int(high, 16) if high else None)
+
+
+def row_cycles(input_path: Path, start_tick: "int | None" = None, jobs: int = 1, profile: "Profile | None" = None,
+               follow: "Follow | None" = None, columnar: bool = False,
+               end_tick: "int | None" = None) -> Iterator[Tuple[int, Callable, Callable, Callable]]:
+    if jobs > 1 and is_compressed(input_path):
+        Logger.warning("Compressed traces are parsed in one process, --jobs ignored")
+        jobs = 1
+    if columnar:
+        # rows are selected and decoded a block at a time, both charged to parse
+        rows_by_tick = columnar_cycles(input_path, SIGNALS, start_tick, end_tick)
+        if profile:
+            rows_by_tick = profile.iterate("parse", rows_by_tick)
+    elif jobs > 1:
+        # rows are parsed, selected and decoded in the workers, here it is waiting for them
+        rows_by_tick = parse_parallel(input_path, SIGNALS, jobs, start_tick, SCALAR_SIGNALS, FIELD_SIGNALS)
+    else:
+        # a followed trace is still growing, a cycle is taken once the next one starts
+        rows = follow.rows(input_path, SIGNALS) if follow else parse(input_path, SIGNALS, start_tick)
+        if profile:
+            rows = profile.iterate("parse", rows)
+        rows_by_tick = average_signal_data_by_tick(rows)
+    if profile:
+        rows_by_tick = profile.iterate("select", rows_by_tick)
+
+    for cyc_cnt, row in rows_by_tick:
+        get = lambda name, row=row: row[name]
+        get_int = lambda name, base=16, row=row: to_int(row[name], base)
+        is_set = lambda name, row=row: to_int(row[name]) == 1
+        yield cyc_cnt, get, get_int, is_set
 
 
-def generate(input_path: Path, verbose: bool = False) -> tuple[int, list]:
+def generate(input_path: Path, verbose: bool = False, columnar: bool = False,
+             on_retire: "Callable | None" = None, window: "Window | None" = None,
+             warmup: int = WARMUP_TICKS, jobs: int = 1, profile: "Profile | None" = None,
+             stats: "PipelineStats | None" = None, follow: "Follow | None" = None) -> tuple[int, list]:
     def to_hex(data) -> "str | None":
         return hex(data) if data is not None else None
     
-    data = parse(input_path)
-    data_by_tick = average_signal_data_by_tick(data)
-    manager = CommandProcessingManager(verbose=verbose)
+    if profile and on_retire:
+        on_retire = profile.timed("export", on_retire)
+    manager = CommandProcessingManager(verbose=verbose, on_retire=on_retire, window=window, stats=stats)
+    tick_count = 0
+    # simulation starts a bit before the window so that commands already in flight are known,
+    # with an index next to the trace reading starts right there
+    start_tick = window.from_tick - warmup if window and window.from_tick is not None else None
+    to_tick = window.to_tick if window else None
+    # nothing after the longest drain below is simulated
+    end_tick = to_tick + warmup if to_tick is not None else None
+    cycles = row_cycles(input_path, start_tick, jobs, profile, follow, columnar, end_tick)
+    simulated = 0
+    # the per-tick messages are built only for a verbose run
+    info, debug = manager.logs(LogLevel.INFO), manager.logs(LogLevel.DEBUG)
+    if profile:
+        # the loop body, pulling the next cycle is charged to parse and select
+        profile.start("simulation")
 
-    for cyc_cnt, index in data_by_tick:
-        manager.set_tick(cyc_cnt)
-        
-        get = lambda name: data[name][index]
-        get_int = lambda name, base=16: to_int(get(name), base)
+    try:
+        for cyc_cnt, get, get_int, is_set in cycles:
+            if start_tick is not None and cyc_cnt < start_tick:
+                continue
+            if to_tick is not None and cyc_cnt > to_tick:
+                # run on only until the commands fetched since the warmup have left the pipeline, and
+                # never more than warmup ticks: a command that never issues stays until the next flush
+                oldest_tick = manager.oldest_active_tick(start_tick)
+                if oldest_tick is None or oldest_tick > to_tick or cyc_cnt > end_tick:
+                    break
+
+            if window is None or window.has_tick(cyc_cnt):
+                tick_count += 1
+            simulated += 1
+            manager.set_tick(cyc_cnt)
         
-        current_cyc_cnt = get_int("/tb/cyc_cnt")
-        manager.vprint(LogLevel.INFO, f"Tick: {current_cyc_cnt}")
-
-        # Fetching
-        manager.vprint(LogLevel.INFO, f"FETCHING")
-        pc = get_int("/tb/uut/cpu/fetch_block/pc")
-        pc_id = get_int("/tb/uut/cpu/id_block/pc_id")
-        manager.vprint(LogLevel.DEBUG, f"PC: {to_hex(pc)}, pc_id: {pc_id}")
-
-        if get_int("/tb/uut/cpu/fetch_block/pc_id_assigned") == 1:
-            manager.new_fetch(pc, pc_id)
-
-        # ID (Dispatch)
-        manager.vprint(LogLevel.INFO, f"DISPATCH")
-        pc_table = [to_int(pc_val) for pc_val in get("/tb/uut/cpu/id_block/pc_table")]
-        if get_int("/tb/uut/cpu/fetch_block/fetch_complete") == 1:
-            dispatching_id = (pc_id - 1) % 8
-            dispatching_pc = pc_table[dispatching_id]
-            fetch_instruction = get_int("/tb/uut/cpu/fetch_block/fetch_instruction")
-            manager.dispatching_complete(dispatching_pc, dispatching_id, fetch_instruction)
-
-        # Decode
-        manager.vprint(LogLevel.INFO, f"DECODE")
-        decode = get("/tb/uut/cpu/id_block/decode")
-        decode_id, decode_pc = to_int(decode[0]), to_int(decode[1])
-        decode_valid = to_int(decode[3]) == 1
-        decode_addr_valid = to_int(decode[4]) == 1
+            if info:
+                manager.vprint(LogLevel.INFO, f"Tick: {get_int('/tb/cyc_cnt')}")
+
+            # Fetching
+            if info:
+                manager.vprint(LogLevel.INFO, "FETCHING")
+            pc = get_int("/tb/uut/cpu/fetch_block/pc")
+            pc_id = get_int("/tb/uut/cpu/id_block/pc_id")
+            if debug:
+                manager.vprint(LogLevel.DEBUG, f"PC: {to_hex(pc)}, pc_id: {pc_id}")
+
+            if is_set("/tb/uut/cpu/fetch_block/pc_id_assigned"):
+                manager.new_fetch(pc, pc_id)
+
+            # ID (Dispatch)
+            if info:
+                manager.vprint(LogLevel.INFO, "DISPATCH")
+            pc_table = to_ints(get("/tb/uut/cpu/id_block/pc_table"))
+            if is_set("/tb/uut/cpu/fetch_block/fetch_complete"):
+                dispatching_id = (pc_id - 1) % 8
+                dispatching_pc = pc_table[dispatching_id]
+                fetch_instruction = get_int("/tb/uut/cpu/fetch_block/fetch_instruction")
+                manager.dispatching_complete(dispatching_pc, dispatching_id, fetch_instruction)
+
+            # Decode
+            if info:
+                manager.vprint(LogLevel.INFO, "DECODE")
+            decode = get("/tb/uut/cpu/id_block/decode")
+            decode_id, decode_pc = to_int(decode[0]), to_int(decode[1])
+            decode_valid = to_int(decode[3]) == 1
+            decode_addr_valid = to_int(decode[4]) == 1
         
-        if decode_valid and decode_addr_valid and pc_table[decode_id] == decode_pc:
-            decode_advance = get("/tb/uut/cpu/id_block/decode_advance") == "St1"
-            manager.vprint(LogLevel.DEBUG, f"decode_pc: {to_hex(decode_pc)}")
-            manager.decoding(decode_pc, decode_id, wait=not decode_advance)
-
-        # Issue
-        manager.vprint(LogLevel.INFO, f"ISSUE")
-        issue = get("/tb/uut/cpu/decode_and_issue_block/issue")
-        issue_pc, issue_id = to_int(issue[0]), to_int(issue[9])
+            if decode_valid and decode_addr_valid and pc_table[decode_id] == decode_pc:
+                decode_advance = get("/tb/uut/cpu/id_block/decode_advance") == "St1"
+                if debug:
+                    manager.vprint(LogLevel.DEBUG, f"decode_pc: {to_hex(decode_pc)}")
+                manager.decoding(decode_pc, decode_id, wait=not decode_advance)
+
+            # Issue
+            if info:
+                manager.vprint(LogLevel.INFO, "ISSUE")
+            issue = get("/tb/uut/cpu/decode_and_issue_block/issue")
+            issue_pc, issue_id = to_int(issue[0]), to_int(issue[9])
         
-        if to_int(issue[10]) == 1:  # issue_stage_valid
-            manager.vprint(LogLevel.DEBUG, f"issue.pc: {to_hex(issue_pc)}, issue.id: {issue_id}")
+            if to_int(issue[10]) == 1:  # issue_stage_valid
+                if debug:
+                    manager.vprint(LogLevel.DEBUG, f"issue.pc: {to_hex(issue_pc)}, issue.id: {issue_id}")
             
-            requests = [
-                get_int("/tb/uut/cpu/decode_and_issue_block/unit_issue[0]/new_request") == 1,  # ALU
-                get_int("/tb/uut/cpu/decode_and_issue_block/unit_issue[1]/new_request") == 1,  # LSU  
-                get_int("/tb/uut/cpu/decode_and_issue_block/unit_issue[2]/new_request") == 1,  # BU
-            ]
+                requests = [
+                    is_set("/tb/uut/cpu/decode_and_issue_block/unit_issue[0]/new_request"),  # ALU
+                    is_set("/tb/uut/cpu/decode_and_issue_block/unit_issue[1]/new_request"),  # LSU  
+                    is_set("/tb/uut/cpu/decode_and_issue_block/unit_issue[2]/new_request"),  # BU
+                ]
             
-            manager.vprint(LogLevel.DEBUG, f"new_requests: ALU={requests[0]}, LSU={requests[1]}, BU={requests[2]}")
+                if debug:
+                    manager.vprint(LogLevel.DEBUG, f"new_requests: ALU={requests[0]}, LSU={requests[1]}, BU={requests[2]}")
 
-            if not any(requests):
-                rs_conflict = get("/tb/uut/cpu/decode_and_issue_block/rs1_conflict") or get("/tb/uut/cpu/decode_and_issue_block/rs2_conflict")
-                assert rs_conflict
-                manager.issue_conflict(issue_pc, issue_id)
-            else:
-                issue_handlers = {
-                    0: manager.issue_alu,  # ALU
-                    1: manager.issue_lsu,  # LSU
-                    2: manager.issue_bu,   # BU
-                }
-                for i, requested in enumerate(requests):
-                    if requested:
-                        handler = issue_handlers[i]
-                        handler(issue_pc, issue_id)
-                        break
-
-        # Flush
-        manager.vprint(LogLevel.INFO, f"FLUSH")
-        if get_int("/tb/uut/cpu/gc_unit_block/gc_fetch_flush") == 1:
-            manager.flush()
-
-        manager.vprint(LogLevel.DEBUG, f"Active commands: {len(manager.active_commands)}")
-        for cmd in manager.active_commands:
-            manager.vprint(LogLevel.DEBUG, f"  - {cmd}")
-        manager.vprint(LogLevel.DEBUG)
-    return len(data_by_tick), manager.postprocess()
+                if not any(requests):
+                    rs_conflict = get("/tb/uut/cpu/decode_and_issue_block/rs1_conflict") or get("/tb/uut/cpu/decode_and_issue_block/rs2_conflict")
+                    assert rs_conflict
+                    manager.issue_conflict(issue_pc, issue_id)
+                else:
+                    issue_handlers = {
+                        0: manager.issue_alu,  # ALU
+                        1: manager.issue_lsu,  # LSU
+                        2: manager.issue_bu,   # BU
+                    }
+                    for i, requested in enumerate(requests):
+                        if requested:
+                            handler = issue_handlers[i]
+                            handler(issue_pc, issue_id)
+                            break
+
+            # Flush
+            if info:
+                manager.vprint(LogLevel.INFO, "FLUSH")
+            if is_set("/tb/uut/cpu/gc_unit_block/gc_fetch_flush"):
+                manager.flush()
+
+            if debug:
+                manager.vprint(LogLevel.DEBUG, f"Active commands: {len(manager.active_commands)}")
+                for cmd in manager.active_commands:
+                    manager.vprint(LogLevel.DEBUG, f"  - {cmd}")
+                manager.vprint(LogLevel.DEBUG)
+    except KeyboardInterrupt:
+        if follow is None:
+            raise
+        # the simulation is still writing the trace, what was read so far is exported
+        Logger.info("Stopped following, finishing the output")
+
+    manager.vprint(LogLevel.INFO, f"to_int cache: {cache_stats()}")
+    if profile:
+        profile.stop()
+        profile.items["simulation"] = simulated
+        profile.add("ticks", tick_count)
+        profile.add("commands", manager.retired_count)
+        profile.add("flushes", manager.flush_count)
+        profile.add("conflicts", manager.conflict_count)
+        profile.add("find_misses", manager.find_misses)
+    if stats:
+        stats.ticks = tick_count
+    return tick_count, manager.postprocess()
 
 
 def main():
     parser = argparse.ArgumentParser(description='Generate pipeline visualization')
     parser.add_argument('input_file', help='Input data file')
     parser.add_argument('output_file', nargs='?', help='Output file (optional)')
-    parser.add_argument('--excel', action='store_true', help='Export to Excel format')
+    parser.add_argument('--excel', action='store_true', help='Export to Excel format (same as --format excel)')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Output format: dense csv/excel table, sparse run-length csv or windowed csv')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose output')
+    parser.add_argument('--numpy', action='store_true', help='Decode signals into NumPy columns (needs numpy)')
+    parser.add_argument('--jobs', type=int, default=1, help='Parse the trace in N worker processes')
+    parser.add_argument('--from-tick', type=int, help='First cycle to export')
+    parser.add_argument('--to-tick', type=int, help='Last cycle to export')
+    parser.add_argument('--pc-range', help='Export only commands with pc in LOW:HIGH (hex, inclusive, either side may be empty)')
+    parser.add_argument('--warmup', type=int, default=WARMUP_TICKS, help='Cycles simulated before --from-tick')
+    parser.add_argument('--log-level', choices=[level.value for level in LogLevel], help='Hide messages below this level')
+    parser.add_argument('--stats', action='store_true', help='Print time per stage, counters and peak memory')
+    parser.add_argument('--stats-json', help='Save the same statistics to a JSON file')
+    parser.add_argument('--no-cache', action='store_true', help='Always parse and simulate the trace')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of cached simulation results')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_LIMIT >> 20, help='Cache size limit, MiB')
+    parser.add_argument('--summary', action='store_true',
+                        help=f'Save CPI, stall and flush statistics next to the trace ({SUMMARY_SUFFIX})')
+    parser.add_argument('--summary-only', action='store_true', help='Only the --summary, no export')
+    parser.add_argument('--top', type=int, default=TOP_STALLS, help='Stalling pcs listed in the summary')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep reading the trace while the simulation writes it (best with --format sparse or window)')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='With --follow, finish after this many seconds without new rows')
     
     args = parser.parse_args()
+    if args.log_level:
+        Logger.setup(LogLevel(args.log_level))
     
     input_path = Path(args.input_file)
     if not input_path.is_file():
         Logger.critical(f"Input file not found: {input_path}")
         return
     
-    if input_path.suffix.lower() != '.lst':
-        Logger.critical(f"Input file must be .lst format, got: {input_path.suffix}")
+    if not input_path.name.lower().endswith(TRACE_SUFFIXES):
+        Logger.critical(f"Input file must be {', '.join(TRACE_SUFFIXES)} format, got: {input_path.name}")
         return
+
+    if args.follow:
+        if is_compressed(input_path):
+            Logger.critical("A compressed trace cannot be followed")
+            return
+        if args.numpy or args.jobs > 1:
+            Logger.warning("A followed trace is read row by row, --numpy and --jobs ignored")
+            args.numpy, args.jobs = False, 1
     
+    window = None
+    if args.from_tick is not None or args.to_tick is not None or args.pc_range:
+        try:
+            pc_low, pc_high = parse_pc_range(args.pc_range) if args.pc_range else (None, None)
+        except ValueError:
+            Logger.critical(f"Wrong --pc-range, expected LOW:HIGH in hex, got: {args.pc_range}")
+            return
+        window = Window(args.from_tick, args.to_tick, pc_low, pc_high)
+    first_tick = args.from_tick if args.from_tick is not None else 1
+
+    output_format = "excel" if args.excel else args.format
     if args.output_file:
         output_path = Path(args.output_file)
     else:
-        base_name = input_path.stem
-        extension = ".xlsx" if args.excel else ".csv"
-        output_path = Path(f"{base_name}{extension}")
+        base_name = trace_stem(input_path)
+        output_path = Path(f"{base_name}{EXTENSIONS[output_format]}")
     
+    profile = None
+    if args.stats or args.stats_json:
+        track_memory()
+        profile = Profile()
+
+    # a verbose run is for the simulation log and a followed trace is still changing,
+    # neither is answered from the cache
+    cache = None if args.no_cache or args.verbose or args.follow else CommandCache(Path(args.cache_dir), args.cache_size << 20)
+
+    stats = PipelineStats(args.top) if args.summary or args.summary_only else None
+
     try:    
-        ticks, completed_commands = generate(input_path, args.verbose)
-        if args.excel:
-            export_to_xlsx(completed_commands, ticks, output_path)
-            Logger.info(f"Exported to Excel: {output_path}")
-        else:
-            export_to_csv(completed_commands, ticks, output_path)
-            Logger.info(f"Exported to CSV: {output_path}")
+        export = None if args.summary_only else open_export(output_format, output_path)
+        on_retire = export.write if export else lambda command: None
+        follow = None
+        if args.follow:
+            # the retired commands are on disk every time the reader catches up with the simulation
+            follow = Follow(args.idle_timeout, on_wait=export.flush if export else None)
+            Logger.info(f"Following {input_path}, finishing after {args.idle_timeout:g}s without new rows or on Ctrl+C")
+        cache_path = cache.path_for(input_path, window, args.warmup) if cache else None
+        # the summary needs the flush and conflict counters of a simulation
+        cached = cache.load(cache_path) if cache and not stats else None
+        # a simulated run also saves its retired commands to the cache
+        recorder = cache.recorder(cache_path) if cache and not cached else None
+        if recorder:
+            write = on_retire
+
+            def on_retire(command):
+                write(command)
+                recorder.write(command)
+
+        try:
+            if cached:
+                ticks, commands = cached
+                with profile.stage("export") if profile else nullcontext():
+                    for command in commands:
+                        export.write(command)
+                Logger.info(f"Simulation results loaded from cache: {cache_path}")
+            else:
+                ticks, _ = generate(input_path, verbose=args.verbose, columnar=args.numpy, on_retire=on_retire,
+                                    window=window, warmup=args.warmup, jobs=args.jobs, profile=profile,
+                                    stats=stats, follow=follow)
+        except BaseException:
+            if recorder:
+                recorder.discard()
+            if export:
+                export.discard()
+            raise
+        if recorder:
+            recorder.close(ticks)
+        if export:
+            with profile.stage("export") if profile else nullcontext():
+                export.close(ticks, first_tick)
+            Logger.info(f"Exported to {FORMATS[output_format]}: {output_path}")
+        if stats:
+            summary_path = input_path.with_name(trace_stem(input_path) + SUMMARY_SUFFIX)
+            stats.save(summary_path)
+            stats.log()
+            Logger.info(f"Summary saved to {summary_path}")
+        if args.stats:
+            profile.log()
+        if args.stats_json:
+            profile.save(Path(args.stats_json))
     except Exception as e:
         Logger.error(f"Error during pipeline generation: {e}")
         Logger.error(f"Error type: {type(e).__name__}")
@@ -17,7 +17,15 @@ COLORS = {
     'ENDC': '\033[0m'              # reset color
 }
 
+LEVEL_ORDER = {level: order for order, level in enumerate(LogLevel)}
+
 class Logger:
+    _level = LogLevel.DEBUG
+
+    @classmethod
+    def enabled(cls, level: LogLevel) -> bool:
+        return LEVEL_ORDER[level] >= LEVEL_ORDER[cls._level]
+
     @classmethod
     def _format_message(cls, level: LogLevel, message: str) -> str:
         color = COLORS.get(level, COLORS['ENDC'])
@@ -25,6 +33,8 @@ class Logger:
     
     @classmethod
     def log(cls, level: LogLevel = LogLevel.DEBUG, *args, **kwargs):
+        if not cls.enabled(level):
+            return
         message = ' '.join(str(arg) for arg in args)
         formatted_message = cls._format_message(level, message)
         print(formatted_message, **kwargs)
@@ -51,4 +61,4 @@ class Logger:
 
     @classmethod
     def setup(cls, level: LogLevel = LogLevel.INFO):
-        cls._level = level
\ No newline at end of file
+        cls._level = level
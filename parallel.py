@@ -0,0 +1,103 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from convert import to_int
+from parser import ColumnLayout, average_signal_data_by_tick, decode_cell, decode_fields, iter_rows, map_file, read_header
+from trace_index import TICK_SIGNAL, TraceIndex
+
+
+# upper bound for the part of the file parsed by one task, keeps results of a task small
+CHUNK_BYTES = 32 << 20
+
+
+def _cycle_start(f: BinaryIO, offset: int, tick_slice: slice) -> int:
+    # first row at or after offset where cyc_cnt changes
+    f.seek(offset - 1)
+    f.readline()
+    position = f.tell()
+    first_cell = None
+    for line in iter(f.readline, b""):
+        cell = line[tick_slice]
+        if first_cell is None:
+            first_cell = cell
+        elif cell != first_cell:
+            return position
+        position += len(line)
+    return position
+
+
+def plan_chunks(f: BinaryIO, start: int, end: int, tick_slice: slice, jobs: int) -> List[Tuple[int, int]]:
+    chunk_bytes = max(min(CHUNK_BYTES, (end - start) // jobs), 1)
+    boundaries = [start]
+    for offset in range(start + chunk_bytes, end, chunk_bytes):
+        boundary = _cycle_start(f, offset, tick_slice)
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    if boundaries[-1] < end:
+        boundaries.append(end)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _decoder(name: str, scalars: Tuple[str, ...], fields: Tuple[str, ...]) -> Callable[[bytes], object]:
+    if name in scalars:
+        return lambda cell: to_int(cell.strip().decode())
+    if name in fields:
+        return lambda cell: decode_fields(cell.strip().decode())
+    return decode_cell
+
+
+def parse_chunk(filename: Path, headers_by_ends: Dict[int, str], signals: Tuple[str, ...],
+                scalars: Tuple[str, ...], fields: Tuple[str, ...], chunk: Tuple[int, int]) -> List[Tuple[int, tuple]]:
+    # runs in a worker: the per-cycle row selection over one cycle-aligned byte range and the
+    # decoding of the selected cells, scalars to ints and structs in fields to tuples of ints
+    layout = ColumnLayout(headers_by_ends, signals)
+    decoders = [_decoder(name, scalars, fields) for name in layout.names]
+    with open(filename, "rb") as f:
+        buffer = map_file(f)
+    rows = iter_rows(layout, buffer, *chunk)
+    return [(tick, tuple(decode(cell) for decode, cell in zip(decoders, layout.split(row.line))))
+            for tick, row in average_signal_data_by_tick(rows)]
+
+
+def parse_parallel(filename: Path, signals: Iterable[str], jobs: Optional[int] = None,
+                   start_tick: Optional[int] = None, scalars: Iterable[str] = (),
+                   fields: Iterable[str] = ()) -> Iterator[Tuple[int, Dict]]:
+    # values come decoded: a scalar is an int (None for x/z), a struct in fields is a tuple
+    # of the ints of its fields, anything else is what decode_cell gives
+    jobs = jobs or os.cpu_count() or 1
+    signals = tuple(signals)
+    index = TraceIndex.load(filename)
+
+    with open(filename, "rb") as f:
+        headers_by_ends, data_offset = (index.headers_by_ends, index.data_offset) if index else read_header(f)
+        start = index.offset_for(start_tick) if index and start_tick is not None else data_offset
+        tick_slice = ColumnLayout(headers_by_ends, [TICK_SIGNAL]).slices[0]
+        chunks = iter(plan_chunks(f, start, os.fstat(f.fileno()).st_size, tick_slice, jobs))
+
+    layout = ColumnLayout(headers_by_ends, signals)
+    task = partial(parse_chunk, filename, headers_by_ends, signals, tuple(scalars), tuple(fields))
+    last_tick = None
+
+    with ProcessPoolExecutor(jobs) as pool:
+        # a bounded number of chunks in flight, results are merged back in file order
+        pending = deque(pool.submit(task, chunk) for _, chunk in zip(range(jobs * 2), chunks))
+        try:
+            while pending:
+                cycles = pending.popleft().result()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(pool.submit(task, chunk))
+
+                for tick, values in cycles:
+                    if last_tick is not None and tick <= last_tick:
+                        continue
+                    last_tick = tick
+                    yield tick, dict(zip(layout.names, values))
+        finally:
+            # the reader stopped early (window end or error)
+            for future in pending:
+                future.cancel()
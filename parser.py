@@ -1,8 +1,28 @@
+import gzip
+import io
+import lzma
+import mmap
 from pathlib import Path
-from typing import List, Dict, Union
+from contextlib import contextmanager
+from operator import itemgetter
+from functools import lru_cache
+from typing import BinaryIO, List, Dict, Union, Iterable, Iterator, Tuple, Optional
 
+from convert import CACHE_SIZE, tick_from_cyc_cnt, to_int
+from logger import Logger
+from trace_index import TICK_SIGNAL, TraceIndex, IndexBuilder
 
-SPLIT_CHAR = "?"
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# bytes of whole lines handed to the line scanners at a time; the pages of a mapped
+# trace are dropped from the process once their block is consumed, so its memory
+# does not grow with the file (they stay in the page cache)
+BLOCK_BYTES = 16 << 20
+MADV_DONTNEED = getattr(mmap, "MADV_DONTNEED", None)
 
 
 def words_end_positions(text: str) -> Dict[int, str]:
@@ -17,66 +37,341 @@ def words_end_positions(text: str) -> Dict[int, str]:
         end_pos: int = start_pos + len(word) - 1
         positions[end_pos] = word
         start_index = end_pos + 1
-        
+
     return positions
 
 
-def find_first_data_line(lines: List[str]) -> int:
-    for index, line in enumerate(lines):
+def split_header(lines: Iterable[str]) -> Tuple[List[str], str]:
+    header_lines: List[str] = []
+    for line in lines:
         if line.strip().startswith("0"):
-            return index
+            return header_lines, line
+        header_lines.append(line)
     raise Exception("First data line not found! Make sure first line of data starts with zero!")
 
 
-def value_by_end_index(line: str, end_index: int) -> str:
-    start_index: int = end_index
-    while start_index > 0 and not line[start_index].isspace():
-        start_index -= 1
-    return line[start_index + 1: end_index + 1]
+def split_fields(value: str) -> List[str]:
+    inner = value[1:-1]
+    if "{" not in inner:
+        return inner.split()
+
+    # glue back the parts of nested structs that split() tore apart
+    fields, pending, depth = [], [], 0
+    for part in inner.split():
+        depth += part.count("{") - part.count("}")
+        pending.append(part)
+        if depth == 0:
+            fields.append(" ".join(pending))
+            pending = []
+    return fields
+
+
+class Struct:
+    __slots__ = ("raw", "_fields")
+
+    # keeps "{...}" as is and splits it only when a field is accessed
+    def __init__(self, raw: str):
+        self.raw = raw
+        self._fields: Optional[List[Union[str, "Struct"]]] = None
+
+    def fields(self) -> List[Union[str, "Struct"]]:
+        if self._fields is None:
+            self._fields = [decode_value(field) for field in split_fields(self.raw)]
+        return self._fields
+
+    def __getitem__(self, index):
+        return self.fields()[index]
 
+    def __iter__(self):
+        return iter(self.fields())
 
-def replace_char_inside_braces(text: str, replacing_char: str, replaced_char: str) -> str:
-    depth: int = 0
-    result = []
-    for char in text:
-        if char == "{":
-            depth += 1
-        elif char == "}":
-            depth -= 1
-        if depth > 0 and char == replacing_char:
-            result.append(replaced_char)
-        else:
-            result.append(char)
-    return "".join(result)
+    def __len__(self) -> int:
+        return len(self.fields())
 
+    def to_list(self) -> List:
+        return [field.to_list() if isinstance(field, Struct) else field for field in self.fields()]
 
-def unnest_braces(value: str) -> Union[str, List]:
+    def __repr__(self) -> str:
+        return self.raw
+
+
+def decode_value(value: str) -> Union[str, Struct]:
     if not value.startswith("{"):
         return value
     assert value.endswith("}")
 
-    value = replace_char_inside_braces(value[1:-1], SPLIT_CHAR, " ")
-    values = [replace_char_inside_braces(v, " ", SPLIT_CHAR) for v in value.split(SPLIT_CHAR)]
-    return list(map(unnest_braces, values))
+    return Struct(value)
+
+
+def decode_cell(cell: bytes) -> Union[str, Struct]:
+    # the dumps are ASCII, a cell is turned into str only when its value is needed
+    return decode_value(cell.strip().decode())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def decode_fields(value: str) -> Tuple[Optional[int], ...]:
+    # "{...}" as the numbers of its fields, a nested struct is None;
+    # idle structs and unchanged tables repeat from cycle to cycle
+    return tuple(None if field.startswith("{") else to_int(field) for field in split_fields(value))
+
+
+class ColumnLayout:
+    def __init__(self, headers_by_ends: Dict[int, str], signals: Optional[Iterable[str]] = None):
+        # values are right-aligned to the end of their header,
+        # so a column spans from the end of the previous one up to its own end
+        starts = {}
+        previous_end = -1
+        for end_index in sorted(headers_by_ends):
+            starts[end_index] = previous_end + 1
+            previous_end = end_index
 
+        columns = select_columns(headers_by_ends, signals)
+        self.names: List[str] = [header for _, header in columns]
+        self.slices: List[slice] = [slice(starts[end_index], end_index + 1) for end_index, _ in columns]
 
-def parse(filename: Path) -> dict:
-    with open(filename, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    first_data_line_index = find_first_data_line(lines)
-    header_lines, data_lines = lines[:first_data_line_index], lines[first_data_line_index:]
+        self.slice_of: Dict[str, slice] = dict(zip(self.names, self.slices))
 
-    # data processing
-    processed_data_lines = [replace_char_inside_braces(line, " ", SPLIT_CHAR) for line in data_lines]
+        getter = itemgetter(*self.slices)
+        self.split = getter if len(self.slices) > 1 else lambda line: (getter(line),)
+
+    def decode(self, line: bytes) -> Dict[str, Union[str, Struct]]:
+        return dict(zip(self.names, map(decode_cell, self.split(line))))
+
+
+class Row:
+    __slots__ = ("layout", "buffer", "start", "end", "_values")
+
+    # a data line as a span of the mapped file: nothing is copied until a cell
+    # is asked for, so rows dropped by the per-cycle selection stay untouched bytes
+    def __init__(self, layout: ColumnLayout, buffer, start: int, end: int):
+        self.layout = layout
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._values: Optional[Dict[str, Union[str, Struct]]] = None
+
+    @property
+    def line(self) -> bytes:
+        return self.buffer[self.start:self.end]
+
+    def raw(self, name: str) -> bytes:
+        column = self.layout.slice_of[name]
+        return self.buffer[self.start + column.start:min(self.start + column.stop, self.end)]
+
+    def __getitem__(self, name: str) -> Union[str, Struct]:
+        if self._values is None:
+            self._values = {}
+        values = self._values
+        if name not in values:
+            values[name] = decode_cell(self.raw(name))
+        return values[name]
+
+
+def select_columns(headers_by_ends: Dict[int, str], signals: Optional[Iterable[str]] = None) -> List[Tuple[int, str]]:
+    if signals is None:
+        return list(headers_by_ends.items())
+
+    signals = set(signals)
+    columns = [(end_index, header) for end_index, header in headers_by_ends.items() if header in signals]
+    missing = signals - {header for _, header in columns}
+    if missing:
+        raise Exception(f"Signals not found in header: {', '.join(sorted(missing))}")
+    return columns
+
+
+def read_header(f: BinaryIO) -> Tuple[Dict[int, str], int]:
+    header_lines, _ = split_header(line.decode() for line in f)
 
     # get headers
     headers_by_ends = {}
     for line in header_lines:
         headers_by_ends.update(words_end_positions(line))
+    return headers_by_ends, sum(len(line.encode()) for line in header_lines)
+
+
+def iter_rows(layout: ColumnLayout, buffer, start: int, end: int) -> Iterator[Row]:
+    find = buffer.find
+    while start < end:
+        line_end = find(b"\n", start, end)
+        line_end = end if line_end < 0 else line_end + 1
+        yield Row(layout, buffer, start, line_end)
+        start = line_end
+
+
+def average_signal_data_by_tick(rows: Iterable[Row]) -> Iterator[Tuple[int, Row]]:
+    # cyc_cnt only grows, so all rows of one cycle come in a row:
+    # keep just the current cycle and yield its middle row once the next one starts.
+    # Only cyc_cnt is decoded here, the rest of the chosen row is decoded on access
+    group_tick, group = None, []
+    dropped = 0
+
+    for row in rows:
+        tick = tick_from_cyc_cnt(row[TICK_SIGNAL])
+        if tick is None:
+            continue
+        if group_tick is not None and tick < group_tick:
+            # a cyc_cnt reset would drop every row after it, they are reported once at the end
+            dropped += 1
+            continue
+        if tick != group_tick:
+            if group:
+                yield group_tick, group[len(group) // 2]
+            group_tick, group = tick, []
+        group.append(row)
+
+    if group:
+        yield group_tick, group[len(group) // 2]
+    if dropped:
+        Logger.warning(f"cyc_cnt went backwards, {dropped} rows skipped")
+
+
+def _open_zstd(filename: Path) -> BinaryIO:
+    if zstandard is None:
+        raise Exception("zstandard is required for .zst traces, install it with `pip install zstandard`")
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True))
+
+
+COMPRESSED_SUFFIXES = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+    ".zst": _open_zstd,
+}
+TRACE_SUFFIXES = (".lst",) + tuple(".lst" + suffix for suffix in COMPRESSED_SUFFIXES)
+
+
+def is_compressed(filename: Path) -> bool:
+    return Path(filename).suffix.lower() in COMPRESSED_SUFFIXES
+
+
+def trace_stem(filename: Path) -> str:
+    # "run.lst.gz" -> "run"
+    name = Path(filename).name
+    for suffix in sorted(TRACE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return Path(filename).stem
+
+
+def open_compressed(filename: Path) -> BinaryIO:
+    return COMPRESSED_SUFFIXES[Path(filename).suffix.lower()](filename)
+
+
+def map_file(f: BinaryIO):
+    # the mapping stays valid after the file is closed and lives as long as rows point into it
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def release_pages(buffer, start: int, end: int) -> None:
+    # the whole pages of [start, end) leave the resident set, a later access reads them again
+    start += -start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if MADV_DONTNEED is not None and end > start:
+        buffer.madvise(MADV_DONTNEED, start, end - start)
+
+
+class TraceSource:
+    # an opened trace: its header and its data as blocks of whole lines. A mapped .lst starts
+    # at the index checkpoint before start_tick; an archive is decompressed from the start
+    # and the cycles before start_tick are skipped by the reader
+    def __init__(self, filename: Path, headers_by_ends: Dict[int, str], index: Optional[TraceIndex] = None,
+                 buffer=None, offset: int = 0, stream: Optional[BinaryIO] = None):
+        self.filename = filename
+        self.headers_by_ends = headers_by_ends
+        self.index = index
+        self.buffer = buffer
+        self.offset = offset
+        self.stream = stream
+
+        # an unfinished index is (re)built while reading from its start or from its last checkpoint
+        self.builds_index = False
+        if index is not None and not index.complete and TICK_SIGNAL in headers_by_ends.values():
+            frontier = index.checkpoints[-1][1] if index.checkpoints else index.data_offset
+            if offset in (index.data_offset, frontier):
+                index.checkpoints = [checkpoint for checkpoint in index.checkpoints if checkpoint[1] < offset]
+                self.builds_index = True
+
+    def layout(self, signals: Optional[Iterable[str]] = None) -> ColumnLayout:
+        return ColumnLayout(self.headers_by_ends, signals)
+
+    def blocks(self) -> Iterator[Tuple[int, object, int, int]]:
+        # (position, buffer, start, end): lines in buffer[start:end], the first one at byte position of the data
+        if self.buffer is None:
+            position, tail = 0, b""
+            for block in iter(lambda: self.stream.read(BLOCK_BYTES), b""):
+                block = tail + block if tail else block
+                end = block.rfind(b"\n") + 1
+                if end:
+                    yield position, block, 0, end
+                position, tail = position + end, block[end:]
+            if tail:
+                yield position, tail, 0, len(tail)
+            return
+
+        buffer, start = self.buffer, self.offset
+        while start < len(buffer):
+            end = buffer.find(b"\n", min(start + BLOCK_BYTES, len(buffer)) - 1)
+            end = len(buffer) if end < 0 else end + 1
+            yield start, buffer, start, end
+            release_pages(buffer, start, end)
+            start = end
+
+    def save_index(self, complete: bool) -> None:
+        self.index.complete = complete
+        self.index.save(self.filename)
+
+
+@contextmanager
+def open_trace(filename: Path, start_tick: Optional[int] = None) -> Iterator[TraceSource]:
+    if is_compressed(filename):
+        # no mapping and no index for an archive
+        with open_compressed(filename) as f:
+            headers_by_ends, data_offset = read_header(f)
+        with open_compressed(filename) as f:
+            f.read(data_offset)  # archives are not seekable
+            yield TraceSource(filename, headers_by_ends, stream=f)
+        return
+
+    index = TraceIndex.load(filename)
+    with open(filename, "rb") as f:
+        if index is None:
+            index = TraceIndex(*read_header(f))
+        buffer = map_file(f)
+    offset = index.offset_for(start_tick) if start_tick is not None else index.data_offset
+    yield TraceSource(filename, index.headers_by_ends, index, buffer, offset)
+
+
+def _source_rows(layout: ColumnLayout, source: TraceSource) -> Iterator[Row]:
+    for _, buffer, start, end in source.blocks():
+        yield from iter_rows(layout, buffer, start, end)
+
+
+@contextmanager
+def read_rows(filename: Path, signals: Optional[Iterable[str]] = None,
+              start_tick: Optional[int] = None) -> Iterator[Tuple[ColumnLayout, Iterator[Row]]]:
+    with open_trace(filename, start_tick) as source:
+        layout = source.layout(signals)
+        rows = _source_rows(layout, source)
+        if source.builds_index:
+            rows = _indexed_rows(rows, IndexBuilder(source.index, source.layout([TICK_SIGNAL]).slices[0]), source)
+        try:
+            yield layout, rows
+        finally:
+            rows.close()
+
+
+def _indexed_rows(rows: Iterator[Row], builder: IndexBuilder, source: TraceSource) -> Iterator[Row]:
+    complete = False
+    try:
+        for row in rows:
+            builder.add(row.buffer, row.start, row.end)
+            yield row
+        complete = True
+    finally:
+        # even a partial index lets the next windowed run seek
+        source.save_index(complete)
+
 
-    # get data by headers
-    return {
-        header: [unnest_braces(value_by_end_index(line, end_index)) 
-                for line in processed_data_lines]
-        for end_index, header in headers_by_ends.items()
-    }
\ No newline at end of file
+def parse(filename: Path, signals: Optional[Iterable[str]] = None, start_tick: Optional[int] = None) -> Iterator[Row]:
+    # get data by headers, one line at a time
+    with read_rows(filename, signals, start_tick) as (layout, rows):
+        yield from rows
@@ -0,0 +1,110 @@
+import heapq
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from logger import Logger
+from processor import STAGE_NAMES, CommandProcessing, Stage
+
+
+# the unit a command was issued to, by its last stage
+UNIT_BY_STAGE = {Stage.AL: "ALU", Stage.M3: "LSU", Stage.B: "BU"}
+CANCEL_STAGES = (Stage.X, Stage.DX, Stage.FX)
+STALL_STAGES = (Stage.W, Stage.C)
+SUMMARY_SUFFIX = ".summary.json"
+TOP_STALLS = 10
+
+
+class PipelineStats:
+    # aggregates of the retired commands, collected by CommandProcessingManager as they retire
+    def __init__(self, top: int = TOP_STALLS):
+        self.top = top
+        self.ticks = 0
+        self.flushes = 0
+        self.conflicts = 0
+        self.commands = 0
+        self.cancelled = 0
+        self.cancelled_cycles = 0
+        self.stage_cycles = [0] * len(STAGE_NAMES)
+        self.unit_issues = {unit: 0 for unit in UNIT_BY_STAGE.values()}
+        # pc -> [executions, stall cycles]
+        self.by_pc: Dict[int, List[int]] = {}
+        # min-heap of the top longest single stalls: (stall cycles, start tick, pc)
+        self._longest: List[Tuple[int, int, int]] = []
+
+    def retire(self, command: CommandProcessing) -> None:
+        self.commands += 1
+        stage_cycles = self.stage_cycles
+        stall = 0
+        for _, length, stage in command.runs:
+            stage_cycles[stage] += length
+            if stage in STALL_STAGES:
+                stall += length
+
+        last_stage = command.runs[-1][2] if command.runs else Stage.NONE
+        if last_stage in CANCEL_STAGES:
+            self.cancelled += 1
+            self.cancelled_cycles += command.last_tick - command.start_tick + 1
+        elif last_stage in UNIT_BY_STAGE:
+            self.unit_issues[UNIT_BY_STAGE[last_stage]] += 1
+
+        address = command.address if command.address is not None else -1
+        pc = self.by_pc.get(address)
+        if pc is None:
+            pc = self.by_pc[address] = [0, 0]
+        pc[0] += 1
+        pc[1] += stall
+
+        if stall:
+            entry = (stall, command.start_tick, address)
+            if len(self._longest) < self.top:
+                heapq.heappush(self._longest, entry)
+            elif entry > self._longest[0]:
+                heapq.heapreplace(self._longest, entry)
+
+    def report(self) -> Dict:
+        completed = self.commands - self.cancelled
+        hotspots = heapq.nlargest(self.top, self.by_pc.items(), key=lambda item: item[1][1])
+        return {
+            "ticks": self.ticks,
+            "commands": self.commands,
+            "completed": completed,
+            "cancelled": self.cancelled,
+            "cpi": round(self.ticks / completed, 3) if completed else None,
+            "ipc": round(completed / self.ticks, 3) if self.ticks else None,
+            "stage_cycles": {STAGE_NAMES[stage]: cycles for stage, cycles in enumerate(self.stage_cycles) if stage and cycles},
+            "unit_issues": self.unit_issues,
+            "conflicts": self.conflicts,
+            "flushes": self.flushes,
+            "flush_penalty": {
+                "cancelled_cycles": self.cancelled_cycles,
+                "cycles_per_flush": round(self.cancelled_cycles / self.flushes, 2) if self.flushes else None,
+            },
+            "stall_hotspots": [
+                {"pc": _pc_hex(address), "executions": executions, "stall_cycles": stall,
+                 "stall_per_execution": round(stall / executions, 2)}
+                for address, (executions, stall) in hotspots if stall
+            ],
+            "longest_stalls": [
+                {"pc": _pc_hex(address), "start_tick": start_tick, "stall_cycles": stall}
+                for stall, start_tick, address in sorted(self._longest, reverse=True)
+            ],
+        }
+
+    def save(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def log(self) -> None:
+        report = self.report()
+        Logger.info(f"{report['ticks']} ticks, {report['completed']} commands completed, {report['cancelled']} cancelled, "
+                    f"CPI {report['cpi']}")
+        Logger.info(", ".join(f"{name}: {cycles}" for name, cycles in report["stage_cycles"].items()))
+        Logger.info(", ".join(f"{unit}: {count}" for unit, count in report["unit_issues"].items())
+                    + f", conflicts: {report['conflicts']}, flushes: {report['flushes']}")
+        for hotspot in report["stall_hotspots"]:
+            Logger.info(f"pc {hotspot['pc']}: {hotspot['stall_cycles']} stall cycles in {hotspot['executions']} executions")
+
+
+def _pc_hex(address: int) -> str:
+    return hex(address)[2:] if address >= 0 else "unknown"
@@ -1,13 +1,80 @@
-from typing import List
+from collections import deque
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 from logger import LogLevel, Logger
 
 
+class Stage(IntEnum):
+    NONE = 0  # no stage recorded for the tick
+    F = 1
+    ID = 2
+    D = 3
+    W = 4
+    C = 5
+    AL = 6
+    B = 7
+    M1 = 8
+    M2 = 9
+    M3 = 10
+    X = 11
+    DX = 12
+    FX = 13
+
+
+STAGE_NAMES = tuple("" if stage == Stage.NONE else stage.name for stage in Stage)
+WAIT_END_STAGES = (Stage.AL, Stage.M1, Stage.M2, Stage.M3, Stage.C, Stage.B)
+
+
+class Window:
+    # tick and pc range of interest, a None bound is open
+    def __init__(self, from_tick: Optional[int] = None, to_tick: Optional[int] = None,
+                 pc_low: Optional[int] = None, pc_high: Optional[int] = None):
+        self.from_tick = from_tick
+        self.to_tick = to_tick
+        self.pc_low = pc_low
+        self.pc_high = pc_high
+
+    def has_tick(self, tick: int) -> bool:
+        return (self.from_tick is None or tick >= self.from_tick) and (self.to_tick is None or tick <= self.to_tick)
+
+    def covers(self, command: "CommandProcessing") -> bool:
+        if self.pc_low is not None or self.pc_high is not None:
+            if command.address is None:
+                return False
+            if self.pc_low is not None and command.address < self.pc_low:
+                return False
+            if self.pc_high is not None and command.address > self.pc_high:
+                return False
+        if self.from_tick is not None and command.last_tick < self.from_tick:
+            return False
+        if self.to_tick is not None and command.start_tick > self.to_tick:
+            return False
+        return True
+
+
 class CommandProcessingManager:
-    def __init__(self, verbose: bool = False):
+    def __init__(self, verbose: bool = False, on_retire: Optional[Callable[["CommandProcessing"], None]] = None,
+                 window: Optional[Window] = None, stats: Optional["PipelineStats"] = None):
+        # retired commands go to on_retire as soon as they are final, or are kept in completed_commands;
+        # with a window only the commands that overlap it are kept (and counted in stats)
+        self.on_retire = on_retire
+        self.window = window
+        self.stats = stats
         self.completed_commands: List[CommandProcessing] = []
-        self.active_commands: List[CommandProcessing] = []
+        # insertion-ordered set of in-flight commands, plus an index by <pc, id>
+        self.active_commands: Dict[CommandProcessing, None] = {}
+        self._active_by_key: Dict[Tuple[int, int], Deque[CommandProcessing]] = {}
         self.current_tick = 0
         self.verbose = verbose
+        self._wx_sequence_count = 0
+        self.retired_count = 0
+        self.flush_count = 0
+        self.conflict_count = 0
+        self.find_misses = 0
+
+    def logs(self, level: LogLevel) -> bool:
+        # for messages that are expensive to build
+        return self.verbose and Logger.enabled(level)
 
     def vprint(self, level: LogLevel = LogLevel.INFO, *args, **kwargs):
         if self.verbose:
@@ -19,16 +86,47 @@ class CommandProcessingManager:
     def new_fetch(self, address: int, id: int):
         command = CommandProcessing(self, address, id)
         command.fetch(self.current_tick)
-        self.active_commands.append(command)
+        self.active_commands[command] = None
+        self._active_by_key.setdefault((address, id), deque()).append(command)
 
-    def _find_command(self, address: int, id: int):
+    def oldest_active_tick(self, since: Optional[int] = None) -> Optional[int]:
+        # active commands are kept in fetch order; older than since are left out
         for command in self.active_commands:
-            if command.address == address and command.id == id:
-                return command
-        
-        self.vprint(LogLevel.WARNING, f"Command not found <pc={hex(address) if address else 'None'}, id={id}>. Active commands: {[f'<pc={hex(cmd.address)}, id={cmd.id}>' for cmd in self.active_commands]}")
+            if since is None or command.start_tick >= since:
+                return command.start_tick
         return None
 
+    def _find_command(self, address: int, id: int):
+        commands = self._active_by_key.get((address, id))
+        if commands:
+            return commands[0]
+
+        self.find_misses += 1
+        if self.logs(LogLevel.WARNING):
+            self.vprint(LogLevel.WARNING, f"Command not found <pc={hex(address) if address else 'None'}, id={id}>. Active commands: {[f'<pc={hex(cmd.address)}, id={cmd.id}>' for cmd in self.active_commands]}")
+        return None
+
+    def _retire(self, command: "CommandProcessing"):
+        del self.active_commands[command]
+        key = (command.address, command.id)
+        commands = self._active_by_key[key]
+        commands.remove(command)  # the oldest one, as _find_command returns it
+        if not commands:
+            del self._active_by_key[key]
+        self._complete(command)
+
+    def _complete(self, command: "CommandProcessing"):
+        self._finalize(command)
+        if self.window and not self.window.covers(command):
+            return
+        self.retired_count += 1
+        if self.stats:
+            self.stats.retire(command)
+        if self.on_retire:
+            self.on_retire(command)
+        else:
+            self.completed_commands.append(command)
+
     def dispatching_complete(self, address: int, id: int, instruction: int):
         command = self._find_command(address, id)
         if not command:
@@ -45,7 +143,13 @@ class CommandProcessingManager:
 
         command.decode(self.current_tick, wait)
 
+    def _in_window(self) -> bool:
+        return self.window is None or self.window.has_tick(self.current_tick)
+
     def issue_conflict(self, address: int, id: int):
+        self.conflict_count += 1
+        if self.stats and self._in_window():
+            self.stats.conflicts += 1
         command = self._find_command(address, id)
         if not command:
             self.vprint(LogLevel.WARNING, f"Cannot issue conflict for non-existent command <pc={hex(address) if address else 'None'}, id={id}>")
@@ -60,7 +164,7 @@ class CommandProcessingManager:
             return
 
         command.issue_bu(self.current_tick)
-        self.completed_commands.append(self.active_commands.pop(self.active_commands.index(command)))
+        self._retire(command)
 
     def issue_alu(self, address: int, id: int):
         command = self._find_command(address, id)
@@ -69,7 +173,7 @@ class CommandProcessingManager:
             return
 
         command.issue_alu(self.current_tick)
-        self.completed_commands.append(self.active_commands.pop(self.active_commands.index(command)))
+        self._retire(command)
 
     def issue_lsu(self, address: int, id: int):
         command = self._find_command(address, id)
@@ -78,122 +182,221 @@ class CommandProcessingManager:
             return
 
         command.issue_lsu(self.current_tick)
-        self.completed_commands.append(self.active_commands.pop(self.active_commands.index(command)))
+        self._retire(command)
 
     def flush(self):
         for command in self.active_commands:
             command.cancel(self.current_tick)
-        self.completed_commands.extend(self.active_commands)
+            self._complete(command)
         self.active_commands.clear()
+        self._active_by_key.clear()
+        self.flush_count += 1
+        if self.stats and self._in_window():
+            self.stats.flushes += 1
         self.vprint(LogLevel.DEBUG, "flush detected")
         
-    def postprocess(self) -> list:
-        processed_commands = []
-        wx_sequence_count = 0
-        
-        for cmd in self.completed_commands:
-            if not cmd.history:
-                processed_commands.append(cmd)
-                continue
-                
-            ticks = sorted(cmd.history.keys())
-            full_history = {
-                tick: cmd.history.get(tick, "C") 
-                for tick in range(min(ticks), max(ticks) + 1)
-            }
-            
-            # FX - reset wx sequence
-            if any("FX" in str(state) for state in full_history.values()):
-                wx_sequence_count = 0
-            
-            new_history = {}
-            sorted_ticks = sorted(full_history.keys())
-            
-            for i, tick in enumerate(sorted_ticks):
-                current = full_history[tick]
-                new_state = current
-                
-                # W before "AL", "M1", "M2", "M3", "C", "B" -> D
-                if current == "W" and i + 1 < len(sorted_ticks):
-                    next_state = full_history[sorted_ticks[i + 1]]
-                    if next_state in ["AL", "M1", "M2", "M3", "C", "B"]:
-                        new_state = "D"
-                
-                if i + 1 < len(sorted_ticks):
-                    next_tick = sorted_ticks[i + 1]
-                    next_state = full_history[next_tick]
-                    
-                    if next_state == "X":
-                        if current == "W":
-                            if wx_sequence_count == 0:
-                                # W before X -> D (1)
-                                new_state = "D"
-                                wx_sequence_count = 1
-                            elif wx_sequence_count == 1:
-                                # W before X after (1) X -> DX
-                                full_history[next_tick] = "DX"
-                                wx_sequence_count = 2
+    def _finalize(self, cmd: "CommandProcessing"):
+        # a retired command never changes again, so its history is rewritten right away,
+        # in retirement order, with a single pass over its runs: the rules look at pairs
+        # of neighbouring ticks, and inside a run those only matter for repeated X
+        runs = cmd.runs
+        if not runs:
+            return
+
+        # FX - reset wx sequence (cancel is always the last event of a command)
+        if runs[-1][2] == Stage.FX:
+            self._wx_sequence_count = 0
+        wx_sequence_count = self._wx_sequence_count
+
+        finalized = []
+        head = None  # new stage of the first tick of the current run
+        for k, (_, length, stage) in enumerate(runs):
+            # ticks with no recorded stage are conflicts
+            if stage == Stage.NONE:
+                stage = Stage.C
+            if head is not None:
+                pieces = [[head, 1]] + ([[stage, length - 1]] if length > 1 else [])
+                head = None
+            elif stage == Stage.X and length > 1 and wx_sequence_count == 1:
+                # after (1) X -> DX
+                pieces = [[Stage.X, 1], [Stage.DX, 1]] + ([[Stage.X, length - 2]] if length > 2 else [])
+                wx_sequence_count = 2
+            else:
+                pieces = [[stage, length]]
+
+            if k + 1 < len(runs):
+                current, next_state = pieces[-1][0], runs[k + 1][2] or Stage.C
+                if current == Stage.W:
+                    # W before "AL", "M1", "M2", "M3", "C", "B" -> D
+                    if next_state in WAIT_END_STAGES:
+                        pieces = _replace_last(pieces, Stage.D)
+                    elif next_state == Stage.X:
+                        if wx_sequence_count == 0:
+                            # W before X -> D (1)
+                            pieces = _replace_last(pieces, Stage.D)
+                            wx_sequence_count = 1
                         elif wx_sequence_count == 1:
-                            # after (1) X -> DX
-                            full_history[next_tick] = "DX"
+                            # W before X after (1) X -> DX
+                            head = Stage.DX
                             wx_sequence_count = 2
-                
-                new_history[tick] = new_state
-            
-            processed_cmd = CommandProcessing(self, cmd.address, cmd.id)
-            processed_cmd.instruction = cmd.instruction
-            processed_cmd.stage = cmd.stage
-            processed_cmd.history = new_history
-            processed_commands.append(processed_cmd)
-        
-        return processed_commands
+                elif next_state == Stage.X and wx_sequence_count == 1:
+                    # after (1) X -> DX
+                    head = Stage.DX
+                    wx_sequence_count = 2
+
+            for piece_stage, piece_length in pieces:
+                _append_run(finalized, cmd.start_tick, piece_stage, piece_length)
+
+        cmd.runs = finalized
+        self._wx_sequence_count = wx_sequence_count
+
+    def postprocess(self) -> list:
+        # commands are finalized as they retire, see _finalize
+        return self.completed_commands
+
+
+def _append_run(runs: List[List[int]], start_tick: int, stage: int, length: int = 1):
+    # extends the last run when the stage is the same
+    if runs and runs[-1][2] == stage:
+        runs[-1][1] += length
+    else:
+        runs.append([runs[-1][0] + runs[-1][1] if runs else start_tick, length, stage])
+
+
+def _replace_last(pieces: List[List[int]], stage: Stage) -> List[List[int]]:
+    # the last tick of [stage, length] pieces gets another stage
+    *rest, (last_stage, length) = pieces
+    return rest + ([[last_stage, length - 1]] if length > 1 else []) + [[stage, 1]]
 
 
 class CommandProcessing:
+    __slots__ = ("address", "instruction", "id", "stage", "start_tick", "runs", "manager")
+
     def __init__(self, manager: CommandProcessingManager, address: int, id: int):
         self.address = address
         self.instruction: int = 0
         self.id = id
         self.stage = "fetching"
-        self.history = {}
+        # history: runs of [start_tick, length, Stage] covering start_tick..last_tick,
+        # ticks with no recorded stage are Stage.NONE runs
+        self.start_tick = 0
+        self.runs: List[List[int]] = []
         self.manager = manager
 
+    @property
+    def last_tick(self) -> int:
+        if not self.runs:
+            return self.start_tick - 1
+        start, length, _ = self.runs[-1]
+        return start + length - 1
+
+    @property
+    def history(self) -> dict:
+        return {
+            tick: STAGE_NAMES[stage]
+            for start, length, stage in self.runs if stage
+            for tick in range(start, start + length)
+        }
+
+    def stage_codes(self, first: int, last: int) -> bytearray:
+        # dense Stage codes of the ticks first..last the command was in the pipeline
+        codes = bytearray()
+        for start, length, stage in self.runs:
+            low, high = max(start, first), min(start + length - 1, last)
+            if low <= high:
+                codes.extend(bytes((stage,)) * (high - low + 1))
+        return codes
+
+    def _get(self, tick) -> int:
+        for start, length, stage in reversed(self.runs):
+            if start <= tick:
+                return stage if tick < start + length else Stage.NONE
+        return Stage.NONE
+
+    def _set(self, tick, stage: Stage):
+        runs = self.runs
+        if not runs:
+            self.start_tick = tick
+            runs.append([tick, 1, stage])
+            return
+
+        last_tick = self.last_tick
+        if tick > last_tick:
+            if tick > last_tick + 1:
+                runs.append([last_tick + 1, tick - last_tick - 1, Stage.NONE])
+            _append_run(runs, self.start_tick, stage)
+            return
+
+        if tick < self.start_tick:
+            runs[0:0] = [[tick, self.start_tick - tick, Stage.NONE]]
+            self.start_tick = tick
+
+        # split the run holding tick, the one changed tick is merged with equal neighbours
+        index = len(runs) - 1
+        while runs[index][0] > tick:
+            index -= 1
+        start, length, old_stage = runs[index]
+        if old_stage == stage:
+            return
+        pieces = [[tick, 1, stage]]
+        if tick > start:
+            pieces.insert(0, [start, tick - start, old_stage])
+        if tick < start + length - 1:
+            pieces.append([tick + 1, start + length - 1 - tick, old_stage])
+        runs[index:index + 1] = pieces
+
+        index += 1 if tick > start else 0
+        if index + 1 < len(runs) and runs[index + 1][2] == stage:
+            runs[index][1] += runs.pop(index + 1)[1]
+        if index > 0 and runs[index - 1][2] == stage:
+            runs[index - 1][1] += runs.pop(index)[1]
+
+    def logs(self, level: LogLevel) -> bool:
+        return self.manager.logs(level)
+
     def vprint(self, *args, **kwargs):
         self.manager.vprint(*args, **kwargs)
 
     def _fill_wait_gap(self, tick):
-        for t in range(max(self.history.keys()) + 1, tick):
-            self.history[t] = "W"
+        gap = tick - self.last_tick - 1
+        if self.runs and gap > 0:
+            _append_run(self.runs, self.start_tick, Stage.W, gap)
 
     def cancel(self, tick):
         self._fill_wait_gap(tick)
 
-        if tick in self.history.keys() and (self.history[tick] == "D" or self.history[tick] == "F"):
-            self.history[tick] += "X"
+        state = self._get(tick)
+        if state == Stage.D:
+            self._set(tick, Stage.DX)
+        elif state == Stage.F:
+            self._set(tick, Stage.FX)
         else:
-            self.history[tick] = "X"
+            self._set(tick, Stage.X)
         self.stage = "canceled"
         
-        self.vprint(LogLevel.DEBUG, f"Command canceled: pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"Command canceled: pc={hex(self.address)}, id={self.id}")
 
     def fetch(self, tick):
         if self.stage != "fetching":
             self.vprint(LogLevel.WARNING, f"Wrong time fetch for command {self}")
         else:
             self.stage = "dispatching"
-            self.history[tick] = "F"
+            self._set(tick, Stage.F)
             
-        self.vprint(LogLevel.DEBUG, f"New fetch: pc={hex(self.address) if self.address else 'None'}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"New fetch: pc={hex(self.address) if self.address else 'None'}, id={self.id}")
 
     def dispatch(self, tick, instruction):
         if self.stage != "dispatching":
             self.vprint(LogLevel.WARNING, f"Wrong time dispatch for command {self}")
         else:
             self.stage = "decoding"
-            self.history[tick] = "ID"
+            self._set(tick, Stage.ID)
             self.instruction = instruction
             
-        self.vprint(LogLevel.DEBUG, f"Dispatching complete: pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"Dispatching complete: pc={hex(self.address)}, id={self.id}")
 
     def decode(self, tick, wait):
         if self.stage != "decoding":
@@ -201,20 +404,22 @@ class CommandProcessing:
         else:
             self._fill_wait_gap(tick)
             if wait:
-                self.history[tick] = "W"
+                self._set(tick, Stage.W)
             else:
                 self.stage = "issuing"
-                self.history[tick] = "D"
+                self._set(tick, Stage.D)
                 
-        self.vprint(LogLevel.DEBUG, f"Decoding: pc={hex(self.address)}, id={self.id}, wait={wait}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"Decoding: pc={hex(self.address)}, id={self.id}, wait={wait}")
 
     def issue_conflict(self, tick):
         if self.stage != "issuing":
             self.vprint(LogLevel.WARNING, f"Wrong time issue_conflict for command {self}")
         else:
-            self.history[tick] = "C"
+            self._set(tick, Stage.C)
             
-        self.vprint(LogLevel.DEBUG, f"Conflict detected for pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"Conflict detected for pc={hex(self.address)}, id={self.id}")
 
     def _issue(self):
         if self.stage != "issuing":
@@ -224,23 +429,26 @@ class CommandProcessing:
 
     def issue_bu(self, tick):
         self._issue()
-        self.history[tick] = "B"
+        self._set(tick, Stage.B)
         
-        self.vprint(LogLevel.DEBUG, f"BU issue: pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"BU issue: pc={hex(self.address)}, id={self.id}")
 
     def issue_alu(self, tick):
         self._issue()
-        self.history[tick] = "AL"
+        self._set(tick, Stage.AL)
         
-        self.vprint(LogLevel.DEBUG, f"ALU issue: pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"ALU issue: pc={hex(self.address)}, id={self.id}")
 
     def issue_lsu(self, tick):
         self._issue()
-        self.history[tick] = "M1"
-        self.history[tick + 1] = "M2"
-        self.history[tick + 2] = "M3"
+        self._set(tick, Stage.M1)
+        self._set(tick + 1, Stage.M2)
+        self._set(tick + 2, Stage.M3)
         
-        self.vprint(LogLevel.DEBUG, f"LSU issue: pc={hex(self.address)}, id={self.id}")
+        if self.logs(LogLevel.DEBUG):
+            self.vprint(LogLevel.DEBUG, f"LSU issue: pc={hex(self.address)}, id={self.id}")
 
     def __str__(self):
         return f"<Command pc={hex(self.address)}, id={self.id}, history={self.history}>"
\ No newline at end of file
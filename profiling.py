@@ -0,0 +1,136 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from logger import Logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# pipeline stages in the order they are reported
+STAGES = ("parse", "select", "simulation", "export")
+
+
+class Profile:
+    # counters of one generate() run and the time spent in every stage; stages nest
+    # (simulation pulls cycles from select, select pulls rows from parse), a stage
+    # is charged only for the time it runs itself
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+        self.items: Dict[str, int] = {}
+        self._stack: List[str] = []
+        self._since = 0.0
+        self._started = time.perf_counter()
+
+    def add(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def __getitem__(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def start(self, stage: str) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            self.seconds[parent] = self.seconds.get(parent, 0.0) + now - self._since
+        self._stack.append(stage)
+        self._since = now
+
+    def stop(self) -> None:
+        now = time.perf_counter()
+        stage = self._stack.pop()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self._since
+        self._since = now
+
+    @contextmanager
+    def stage(self, stage: str):
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def iterate(self, stage: str, iterable: Iterable) -> Iterator:
+        # the time spent producing every item goes to stage, items are counted
+        iterator = iter(iterable)
+        count = 0
+        try:
+            while True:
+                self.start(stage)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.stop()
+                count += 1
+                yield item
+        finally:
+            self.items[stage] = self.items.get(stage, 0) + count
+
+    def timed(self, stage: str, function: Callable) -> Callable:
+        # every call is an item of stage
+        def wrapper(*args, **kwargs):
+            self.items[stage] = self.items.get(stage, 0) + 1
+            self.start(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.stop()
+
+        return wrapper
+
+    def report(self) -> Dict:
+        stages = {}
+        for stage in sorted(self.seconds, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+            seconds, items = self.seconds[stage], self.items.get(stage)
+            stages[stage] = {
+                "seconds": round(seconds, 3),
+                "items": items,
+                "items_per_second": round(items / seconds) if items and seconds else None,
+            }
+        return {
+            "total_seconds": round(time.perf_counter() - self._started, 3),
+            "stages": stages,
+            "counters": dict(self.counters),
+            "peak_memory_bytes": peak_memory(),
+        }
+
+    def log(self) -> None:
+        report = self.report()
+        for stage, values in report["stages"].items():
+            rate = f", {values['items']} items, {values['items_per_second']}/s" if values["items"] else ""
+            Logger.info(f"{stage}: {values['seconds']:.3f}s{rate}")
+        Logger.info(", ".join(f"{name}: {value}" for name, value in report["counters"].items()))
+        memory = report["peak_memory_bytes"]
+        Logger.info(f"total: {report['total_seconds']:.3f}s, peak memory: "
+                    f"{f'{memory / (1 << 20):.1f} MiB' if memory is not None else 'unknown'}")
+
+    def save(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def track_memory() -> None:
+    # without resource the peak is taken from tracemalloc, which has to run from the start
+    if resource is None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def peak_memory() -> Optional[int]:
+    # peak resident set; pages of a mapped trace count while they are mapped in,
+    # parser.release_pages keeps that to the block being read
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return None
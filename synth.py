@@ -0,0 +1,171 @@
+import argparse
+import random
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from generator import SIGNALS
+from logger import Logger
+
+
+# the signals generate() reads, by role
+CYC_CNT, PC, PC_ID_ASSIGNED, FETCH_COMPLETE, FETCH_INSTRUCTION, PC_ID, PC_TABLE, DECODE, DECODE_ADVANCE, \
+    ISSUE, ALU_REQUEST, LSU_REQUEST, BU_REQUEST, RS1_CONFLICT, RS2_CONFLICT, FETCH_FLUSH = SIGNALS
+UNIT_REQUESTS = (ALU_REQUEST, LSU_REQUEST, BU_REQUEST)
+
+IDLE_DECODE = "{3'h0 32'h00000000 32'h00000000 1'h0 1'h0 {2'h0 1'h0}}"
+IDLE_ISSUE = "{32'h00000000 5'h00 5'h00 5'h00 1'h0 1'h0 {3'h0 1'h0} 32'h00000000 32'h00000000 3'h0 1'h0}"
+
+
+def hex_value(bits: int, value: Optional[int]) -> str:
+    # Modelsim hex literal, None is all x
+    digits = (bits + 3) // 4
+    return f"{bits}'h" + ("x" * digits if value is None else f"{value:0{digits}x}")
+
+
+class TraceSynthesizer:
+    # a toy in-order pipeline of the Taiga front end: fetch, dispatch, decode, a single issue slot.
+    # Issue stalls on a register conflict and decode waits with stall_rate, a branch
+    # flushes the front end with flush_rate
+    def __init__(self, deltas: int = 3, extra_columns: int = 20, stall_rate: float = 0.2,
+                 flush_rate: float = 0.3, seed: int = 1):
+        self.deltas = deltas
+        self.stall_rate = stall_rate
+        self.flush_rate = flush_rate
+        self.random = random.Random(seed)
+        self.extra = [f"/tb/noise/sig{i}" for i in range(extra_columns)]
+        self.signals = ["ps", "delta", "/tb/clk", CYC_CNT, PC, PC_ID, PC_ID_ASSIGNED, PC_TABLE, FETCH_COMPLETE,
+                        FETCH_INSTRUCTION, DECODE, DECODE_ADVANCE, ISSUE, *UNIT_REQUESTS, RS1_CONFLICT,
+                        RS2_CONFLICT, FETCH_FLUSH] + self.extra
+
+        self.fetch_pc = 0x100
+        self.next_id = 0
+        self.pc_table: List[Optional[int]] = [None] * 8
+        self.fetched = None
+        self.decode_queue = []
+        self.issue_slot = None
+        self.flush_next = False
+
+    def _cycle(self, tick: int) -> Dict[str, str]:
+        rnd = self.random
+        values = {signal: "1'h0" for signal in self.signals}
+        values[DECODE_ADVANCE] = "St0"
+        values[CYC_CNT] = hex_value(32, tick if tick >= 0 else None)
+        values[PC] = hex_value(32, self.fetch_pc)
+        values[PC_ID] = hex_value(3, self.next_id)
+        values[FETCH_INSTRUCTION] = hex_value(32, None)
+        values[DECODE] = IDLE_DECODE
+        values[ISSUE] = IDLE_ISSUE
+        for signal in self.extra:
+            values[signal] = hex_value(16, rnd.randrange(1 << 16))
+        if tick < 0:
+            return values
+
+        # issue
+        issued = False
+        if self.issue_slot:
+            issue_id, issue_pc = self.issue_slot
+            values[ISSUE] = "{%s 5'h01 5'h02 5'h03 1'h0 1'h0 {3'h0 1'h1} 32'h00000000 32'h00000000 %s 1'h1}" % (
+                hex_value(32, issue_pc), hex_value(3, issue_id))
+            if rnd.random() < self.stall_rate:
+                values[RS1_CONFLICT] = "1'h1"
+            else:
+                unit = rnd.choice([0, 0, 1, 2])
+                values[UNIT_REQUESTS[unit]] = "1'h1"
+                issued = True
+                self.issue_slot = None
+                if unit == 2 and rnd.random() < self.flush_rate:
+                    self.flush_next = True
+
+        # decode
+        if self.decode_queue:
+            decode_id, decode_pc = self.decode_queue[0]
+            values[DECODE] = "{%s %s 32'h00a00093 1'h1 1'h1 {2'h1 1'h0}}" % (
+                hex_value(3, decode_id), hex_value(32, decode_pc))
+            if self.issue_slot is None and rnd.random() < 1 - self.stall_rate:
+                values[DECODE_ADVANCE] = "St1"
+                self.issue_slot = self.decode_queue.pop(0)
+
+        # dispatch
+        if self.fetched:
+            values[FETCH_COMPLETE] = "1'h1"
+            values[FETCH_INSTRUCTION] = hex_value(32, rnd.randrange(1 << 32))
+            self.decode_queue.append(self.fetched)
+            self.fetched = None
+
+        # fetch
+        in_flight = len(self.decode_queue) + (self.issue_slot is not None)
+        if in_flight < 3 and rnd.random() < 0.7:
+            values[PC_ID_ASSIGNED] = "1'h1"
+            self.pc_table[self.next_id] = self.fetch_pc
+            self.fetched = (self.next_id, self.fetch_pc)
+            self.next_id = (self.next_id + 1) % 8
+            self.fetch_pc += 4
+        values[PC_TABLE] = "{" + " ".join(hex_value(32, pc) for pc in self.pc_table) + "}"
+
+        if self.flush_next and not issued:
+            values[FETCH_FLUSH] = "1'h1"
+            self.flush_next = False
+            self.fetched, self.decode_queue, self.issue_slot = None, [], None
+            self.fetch_pc = rnd.choice([0x100, 0x200, 0x300])
+        return values
+
+    def _widths(self, cycles: int) -> Dict[str, int]:
+        # every value of a signal has the same length, except ps which only grows
+        values = {signal: "1'h0" for signal in self.signals}
+        values.update({signal: hex_value(16, 0) for signal in self.extra})
+        values.update({
+            "ps": str((cycles + 1) * 10000),
+            "delta": f"+{self.deltas - 1}",
+            "/tb/clk": "St0",
+            CYC_CNT: hex_value(32, 0),
+            PC: hex_value(32, 0),
+            PC_ID: hex_value(3, 0),
+            FETCH_INSTRUCTION: hex_value(32, 0),
+            PC_TABLE: "{" + " ".join([hex_value(32, 0)] * 8) + "}",
+            DECODE: IDLE_DECODE,
+            DECODE_ADVANCE: "St0",
+            ISSUE: IDLE_ISSUE,
+        })
+        return {signal: max(len(signal), len(value)) + 1 for signal, value in values.items()}
+
+    def write(self, path: Path, cycles: int) -> None:
+        widths = self._widths(cycles)
+        with open(path, "w", newline="\n") as f:
+            # the header is split on two lines, as Modelsim does for long names
+            f.write("".join((signal if i % 2 else "").rjust(widths[signal]) for i, signal in enumerate(self.signals)).rstrip() + "\n")
+            f.write("".join((signal if not i % 2 else "").rjust(widths[signal]) for i, signal in enumerate(self.signals)) + "\n")
+
+            previous = None
+            for tick in range(-2, cycles):
+                values = self._cycle(tick)
+                # a cycle takes several delta rows, the first half still shows the previous values
+                rows = self.random.randint(1, self.deltas)
+                for delta in range(rows):
+                    row = dict(values if previous is None or delta >= rows // 2 else previous)
+                    row[CYC_CNT] = values[CYC_CNT]
+                    row["ps"] = str((tick + 2) * 10000)
+                    row["delta"] = f"+{delta}"
+                    row["/tb/clk"] = "St1" if delta % 2 else "St0"
+                    f.write("".join(row[signal].rjust(widths[signal]) for signal in self.signals) + "\n")
+                previous = values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Modelsim .lst trace of the Taiga pipeline')
+    parser.add_argument('output_file', help='Output .lst file')
+    parser.add_argument('--cycles', type=int, default=10000, help='Simulated cycles')
+    parser.add_argument('--deltas', type=int, default=3, help='Up to this many delta rows per cycle')
+    parser.add_argument('--extra-columns', type=int, default=20, help='Unrelated signals added to every row')
+    parser.add_argument('--stall-rate', type=float, default=0.2, help='Chance of an issue conflict or a decode wait per cycle')
+    parser.add_argument('--flush-rate', type=float, default=0.3, help='Chance that an issued branch flushes the front end')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same trace')
+
+    args = parser.parse_args()
+
+    synthesizer = TraceSynthesizer(args.deltas, args.extra_columns, args.stall_rate, args.flush_rate, args.seed)
+    synthesizer.write(Path(args.output_file), args.cycles)
+    Logger.info(f"Written {args.cycles} cycles to {args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import json
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from convert import tick_from_cyc_cnt
+from logger import Logger
+
+
+TICK_SIGNAL = "/tb/cyc_cnt"
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+# a checkpoint every CHECKPOINT_CYCLES cycles of cyc_cnt
+CHECKPOINT_CYCLES = 1024
+
+
+def index_path(filename: Path) -> Path:
+    return Path(filename).with_name(Path(filename).name + INDEX_SUFFIX)
+
+
+def _file_stamp(filename: Path) -> Tuple[int, int]:
+    stat = Path(filename).stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+class TraceIndex:
+    # sidecar next to the .lst: header layout, where the data starts
+    # and the byte offset of the first row of every CHECKPOINT_CYCLES-th cycle
+    def __init__(self, headers_by_ends: Dict[int, str], data_offset: int,
+                 checkpoints: Optional[List[Tuple[int, int]]] = None, complete: bool = False,
+                 size: int = 0, mtime_ns: int = 0):
+        self.headers_by_ends = headers_by_ends
+        self.data_offset = data_offset
+        self.checkpoints: List[Tuple[int, int]] = checkpoints or []
+        self.complete = complete
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def offset_for(self, tick: int) -> int:
+        # the latest checkpoint at or before tick
+        position = bisect_right([checkpoint_tick for checkpoint_tick, _ in self.checkpoints], tick)
+        return self.checkpoints[position - 1][1] if position else self.data_offset
+
+    @classmethod
+    def load(cls, filename: Path) -> Optional["TraceIndex"]:
+        try:
+            with open(index_path(filename), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION or (data["size"], data["mtime_ns"]) != _file_stamp(filename):
+                return None
+            return cls(
+                {int(end_index): header for end_index, header in data["headers"]},
+                data["data_offset"],
+                [tuple(checkpoint) for checkpoint in data["checkpoints"]],
+                data["complete"],
+                data["size"],
+                data["mtime_ns"],
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, filename: Path) -> None:
+        self.size, self.mtime_ns = _file_stamp(filename)
+        data = {
+            "version": INDEX_VERSION,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "headers": sorted(self.headers_by_ends.items()),
+            "data_offset": self.data_offset,
+            "checkpoints": self.checkpoints,
+            "complete": self.complete,
+        }
+        try:
+            with open(index_path(filename), "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            Logger.warning(f"Cannot save index {index_path(filename)}: {e}")
+
+
+class IndexBuilder:
+    # fed with every data row while the trace is read from its first data line
+    def __init__(self, index: TraceIndex, tick_slice: slice):
+        self.index = index
+        self.tick_slice = tick_slice
+        self._last_cell = None
+        self._last_tick = -1
+        self._cycles = 0
+
+    def add(self, buffer, start: int, end: int) -> None:
+        cell = buffer[start + self.tick_slice.start:min(start + self.tick_slice.stop, end)]
+        if cell == self._last_cell:
+            return
+        self._last_cell = cell
+
+        tick = tick_from_cyc_cnt(cell.decode())
+        if tick is None or tick <= self._last_tick:
+            return
+        if self._cycles % CHECKPOINT_CYCLES == 0:
+            self.index.checkpoints.append((tick, start))
+        self._last_tick = tick
+        self._cycles += 1